@@ -1,33 +1,189 @@
-from django.contrib import admin
-from .models import Comment, Post, Profile
+import logging
+from collections import Counter
+
+from django.contrib import admin, messages
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.html import format_html
+from taggit.models import TaggedItem
+from .cache import bump
+from .models import (
+    SEARCH_CONFIG,
+    Comment,
+    Post,
+    Profile,
+    adjust_month_stats,
+    adjust_tag_stats,
+    month_of,
+    refresh_approved_comment_counts,
+)
+from .pagination import EstimatedCountPaginator
+from .related import schedule_refresh
 
 # Register your models here.
 
+logger = logging.getLogger(__name__)
+
+# Rows changed per transaction by the bulk actions
+ACTION_BATCH_SIZE = 1000
+
+
+def batches(queryset, size=ACTION_BATCH_SIZE):
+    """Primary keys of `queryset` in lists of `size`."""
+    pks = list(queryset.order_by().values_list('pk', flat=True))
+    for start in range(0, len(pks), size):
+        yield pks[start:start + size]
+
+
+def set_status(post_ids, status):
+    """
+    Move posts to `status` with one UPDATE, doing what the post signals
+    would: adjust tag and month counts, refresh related posts and invalidate
+    cached pages.
+    """
+    rows = list(
+        Post.objects.filter(pk__in=post_ids)
+        .exclude(status=status)
+        .values_list('pk', 'slug', 'author_id', 'created')
+    )
+    changing = {pk: slug for pk, slug, _, _ in rows}
+    if not changing:
+        return 0
+    author_ids = {author_id for _, _, author_id, _ in rows}
+    Post.objects.filter(pk__in=changing).update(status=status, updated=timezone.now())
+
+    tagged = TaggedItem.objects.filter(
+        content_type__app_label='blog',
+        content_type__model='post',
+        object_id__in=changing,
+    ).values_list('tag_id', 'tag__slug')
+    delta = 1 if status == 'published' else -1
+    tag_ids = Counter()
+    tag_slugs = set()
+    for tag_id, slug in tagged:
+        tag_ids[tag_id] += delta
+        tag_slugs.add(slug)
+    adjust_tag_stats(tag_ids)
+    months = Counter()
+    for _, _, _, created in rows:
+        months[month_of(created)] += delta
+    adjust_month_stats(months)
+    schedule_refresh(changing)
+    bump(
+        'list',
+        *[f'post:{slug}' for slug in changing.values()],
+        *[f'author:{author_id}' for author_id in author_ids],
+        *[f'tag:{slug}' for slug in tag_slugs],
+    )
+    return len(changing)
+
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ['title', 'author', 'status', 'created', 'updated']
-    list_filter = ['status', 'created', 'author']
-    search_fields = ['title', 'content']
+    list_filter = ['status', 'created']
+    list_select_related = ['author']
+    search_fields = ['title']
+    search_help_text = 'Full-text search of titles and content.'
     prepopulated_fields = {'slug': ('title',)}
-    date_hierarchy = 'created'
+    raw_id_fields = ['author']
     ordering = ['-created']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['publish_posts', 'unpublish_posts']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('content_html', 'search_vector')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        # The stored search vector and its GIN index, not ILIKE over content
+        query = SearchQuery(search_term, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=query), False
+
+    def change_status(self, request, queryset, status):
+        changed = 0
+        for number, post_ids in enumerate(batches(queryset), 1):
+            with transaction.atomic():
+                changed += set_status(post_ids, status)
+            logger.info('%s: batch %d done, %d posts changed', status, number, changed)
+        self.message_user(
+            request, f'{changed} post(s) marked as {status}.', messages.SUCCESS
+        )
+
+    @admin.action(description='Publish selected posts')
+    def publish_posts(self, request, queryset):
+        self.change_status(request, queryset, 'published')
+
+    @admin.action(description='Unpublish selected posts')
+    def unpublish_posts(self, request, queryset):
+        self.change_status(request, queryset, 'draft')
 
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
-    list_display = ['author', 'post', 'created', 'active']
-    list_filter = ['active', 'created', 'updated']
-    search_fields = ['author__username', 'author__email', 'content']
+    list_display = ['author', 'post', 'created', 'active', 'approved']
+    list_filter = ['active', 'approved', 'created', 'updated']
+    list_select_related = ['author', 'post']
+    search_fields = ['author__username']
+    search_help_text = 'Exact username or email of the author.'
+    raw_id_fields = ['post', 'author']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     actions = ['approve_comments']
 
-    def approve_comments(self, request, queryset):
-        queryset.update(approved=True)
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer(
+            'post__content', 'post__content_html', 'post__search_vector'
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        # Indexed lookups only: the unique username and UPPER(email) indexes,
+        # then the comment author foreign key.
+        authors = get_user_model().objects.filter(
+            Q(username=search_term) | Q(email__iexact=search_term)
+        ).values('pk')
+        return queryset.filter(author__in=authors), False
 
-    approve_comments.short_description = "Approve selected comments"
+    @admin.action(description='Approve selected comments')
+    def approve_comments(self, request, queryset):
+        approved = 0
+        for number, comment_ids in enumerate(batches(queryset.filter(approved=False)), 1):
+            with transaction.atomic():
+                posts = list(
+                    Post.objects.filter(comments__in=comment_ids)
+                    .distinct().values_list('pk', 'slug', 'author_id')
+                )
+                approved += Comment.objects.filter(pk__in=comment_ids).update(approved=True)
+                # update() sends no signals, so sync the affected posts here.
+                refresh_approved_comment_counts([pk for pk, _, _ in posts])
+                bump(
+                    *[f'post:{slug}' for _, slug, _ in posts],
+                    *[f'author:{author_id}' for _, _, author_id in posts],
+                )
+            logger.info('Approve comments: batch %d done, %d approved', number, approved)
+        self.message_user(
+            request, f'{approved} comment(s) approved.', messages.SUCCESS
+        )
 
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
-    list_display = ['user', 'date_of_birth', 'photo']
+    list_display = ['user', 'date_of_birth', 'thumbnail']
+    list_select_related = ['user']
     raw_id_fields = ['user']
+    readonly_fields = ['thumbnail']
+
+    @admin.display(description='Photo')
+    def thumbnail(self, obj):
+        if not obj.photo:
+            return '-'
+        return format_html(
+            '<img src="{}" width="48" height="48" alt="">', obj.photo_url('small')
+        )
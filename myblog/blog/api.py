@@ -0,0 +1,70 @@
+from rest_framework import permissions, viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from taggit.models import Tag
+from .models import Post
+from .serializers import (
+    CommentSerializer,
+    PostDetailSerializer,
+    PostSerializer,
+    SparseFieldsMixin,
+    TagSerializer,
+)
+
+
+class PostCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created', '-id')
+
+
+class CommentCursorPagination(PostCursorPagination):
+    ordering = ('created', 'id')
+
+
+class TagCursorPagination(PostCursorPagination):
+    ordering = ('name', 'id')
+
+
+class PostViewSet(viewsets.ReadOnlyModelViewSet):
+    """Published posts; `?fields=` selects a subset of the serialized fields."""
+    permission_classes = [permissions.AllowAny]
+    pagination_class = PostCursorPagination
+    lookup_field = 'slug'
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return PostDetailSerializer
+        if self.action == 'comments':
+            return CommentSerializer
+        return PostSerializer
+
+    def get_queryset(self):
+        requested = SparseFieldsMixin.requested_fields(self.request)
+        queryset = Post.published.defer('search_vector')
+        if self.action != 'retrieve':
+            queryset = queryset.defer('content', 'content_html')
+        # Only join or prefetch what the response is going to use, so the
+        # list stays at one or two queries per page.
+        if requested is None or 'author' in requested:
+            queryset = queryset.select_related('author')
+        if requested is None or 'tags' in requested:
+            queryset = queryset.prefetch_related('tags')
+        return queryset
+
+    @action(detail=True, pagination_class=CommentCursorPagination)
+    def comments(self, request, slug=None):
+        post = self.get_object()
+        comments = post.comments.filter(approved=True).select_related('author')
+        page = self.paginate_queryset(comments)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class TagViewSet(viewsets.ReadOnlyModelViewSet):
+    permission_classes = [permissions.AllowAny]
+    pagination_class = TagCursorPagination
+    serializer_class = TagSerializer
+    queryset = Tag.objects.all()
+    lookup_field = 'slug'
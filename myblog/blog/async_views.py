@@ -0,0 +1,126 @@
+"""
+Async versions of the read-only views, for running under ASGI.
+
+They fetch data with the async ORM so a request waiting on Postgres does
+not hold a worker thread. CPU-bound Markdown rendering and template
+rendering run through sync_to_async, which carries the request's context
+(e.g. its Server-Timing metrics) into the thread. Set
+BLOG_ASYNC_VIEWS=True to route the blog URLs here.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.search import SearchQuery
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.http import Http404
+from django.shortcuts import render
+from .cache import cache_anonymous_page, conditional_page
+from .forms import CommentForm, SearchForm
+from .models import SEARCH_CONFIG, Post
+from .pagination import CursorPaginator
+from .related import related_posts_for
+from . import views
+
+arender = sync_to_async(render)
+
+
+@conditional_page(views.post_list_namespaces)
+@cache_anonymous_page(views.post_list_namespaces)
+async def post_list(request, tag_slug=None):
+    user = await request.auser()
+    tag = None
+    if tag_slug:
+        tag = await sync_to_async(views.get_tag_or_404)(tag_slug)
+
+    paginator = CursorPaginator(views.published_posts_for(tag), views.POSTS_PER_PAGE)
+    posts = await paginator.apage(request.GET.get('cursor'))
+
+    draft_count = 0
+    if user.is_authenticated:
+        draft_count = (await sync_to_async(views.author_stats)(user))['draft']['posts']
+
+    return await arender(
+        request,
+        'blog/post_list.html',
+        {
+            'posts': posts,
+            'draft_count': draft_count,
+            'tag': tag
+        }
+    )
+
+
+@conditional_page(views.post_detail_namespaces)
+@cache_anonymous_page(views.post_detail_namespaces)
+async def post_detail(request, slug):
+    if request.method not in ('GET', 'HEAD'):
+        # Posting a comment is a write; leave it to the sync view.
+        return await sync_to_async(views.post_detail)(request, slug=slug)
+
+    user = await request.auser()
+    try:
+        post = await views.visible_posts_for(user).aget(slug=slug)
+    except Post.DoesNotExist:
+        raise Http404('No Post matches the given query.')
+
+    if post.needs_render():
+        # Off the shared thread: rendering touches no database connection
+        await sync_to_async(post.render_content, thread_sensitive=False)()
+        await sync_to_async(views.store_rendered_content)(post)
+
+    comments = await views.comments_paginator(post).apage(request.GET.get('cursor'))
+    related = [link async for link in related_posts_for(post)]
+
+    return await arender(
+        request,
+        'blog/post_detail.html',
+        {
+            'comments': comments,
+            'comment_form': CommentForm(),
+            'post': post,
+            'related': related,
+        }
+    )
+
+
+async def post_search(request):
+    form = SearchForm()
+    query = None
+    results = []
+
+    if 'query' in request.GET:
+        form = SearchForm(request.GET)
+        if form.is_valid():
+            query = form.cleaned_data['query']
+            search_query = SearchQuery(query, config=SEARCH_CONFIG)
+            matches = views.search_matches(search_query)[:views.SEARCH_RESULTS_LIMIT]
+
+            paginator = Paginator(matches, views.SEARCH_RESULTS_PER_PAGE)
+            # Count with the async ORM; the paginator then only does arithmetic
+            paginator.count = await matches.acount()
+            try:
+                number = paginator.validate_number(request.GET.get('page') or 1)
+            except PageNotAnInteger:
+                number = 1
+            except EmptyPage:
+                number = paginator.num_pages
+            bottom = (number - 1) * paginator.per_page
+            rows = [
+                post async for post in matches[bottom:bottom + paginator.per_page]
+            ]
+            results = Page(rows, number, paginator)
+
+            headlines = {
+                pk: headline
+                async for pk, headline in views.search_headlines(rows, search_query)
+            }
+            for post in rows:
+                post.headline = views.highlight(headlines.get(post.pk, ''))
+
+    return await arender(
+        request,
+        'blog/search.html',
+        {
+            'form': form,
+            'query': query,
+            'results': results,
+        }
+    )
@@ -0,0 +1,262 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+from taggit.models import Tag
+
+from .metrics import record_cache
+from .routers import _read_alias
+
+PAGE_CACHE_TIMEOUT = 60 * 15
+# Generations first created by a read (any slug or tag requested, even
+# missing ones) expire, so crawlers cannot grow the cache without bound.
+# One that expires comes back newer, which only costs a cache miss.
+GENERATION_TIMEOUT = 60 * 60 * 24
+
+# Namespaces whose generation counters make up the cache keys:
+#   'lists'        every post list page (tag renames, author changes, the
+#                  counts in the sidebars)
+#   'list'         the unfiltered post list
+#   'tag:<slug>'   the list of posts tagged <slug>
+#   'post:<slug>'  the detail page of one post
+#   'author:<id>'  the dashboard counts of one author's posts and comments
+#
+# A generation is the time of the last write in nanoseconds, so besides
+# keying the page cache it doubles as the Last-Modified stamp of the page.
+#
+# A bump runs when the write commits on the primary, before replicas have
+# it. Pages read from a replica within BLOG_REPLICA_PIN_SECONDS of a bump
+# may still show the old data, so they are neither cached nor given
+# validators: stored under the new generation, they would outlive the lag.
+
+
+def _generation_key(namespace):
+    return f'blog:generation:{namespace}'
+
+
+def _new_generation():
+    # Time based rather than starting at 1, so a counter evicted from the
+    # cache never comes back with a value that old entries were stored under.
+    return time.time_ns()
+
+
+def generations(*namespaces):
+    keys = {_generation_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(keys)
+    missing = {key: _new_generation() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, GENERATION_TIMEOUT)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def settled(stamps):
+    """True unless this request reads a replica that may lag `stamps`."""
+    if _read_alias.get() is None:
+        return True
+    lag = settings.BLOG_REPLICA_PIN_SECONDS * 10**9
+    return time.time_ns() - max(stamps) >= lag
+
+
+def request_generations(request, namespaces):
+    """generations() memoized on the request, shared by the decorators below."""
+    memo = request.__dict__.setdefault('_blog_generations', {})
+    key = tuple(namespaces)
+    if key not in memo:
+        memo[key] = generations(*namespaces)
+    return memo[key]
+
+
+def _bump(namespaces):
+    keys = [_generation_key(namespace) for namespace in namespaces]
+    current = cache.get_many(keys)
+    now = _new_generation()
+    # Always move forward, even if this host's clock lags the last writer's.
+    cache.set_many({key: max(now, current.get(key, 0) + 1) for key in keys}, None)
+
+
+def bump(*namespaces):
+    """Invalidate every page cached under `namespaces` once the write commits."""
+    namespaces = set(namespaces)
+    transaction.on_commit(lambda: _bump(namespaces))
+
+
+def _tag_key(slug):
+    return f'blog:tag:{slug}'
+
+
+def get_tag(slug):
+    """Tag by slug from the cache, falling back to the database; None if missing."""
+    tag = cache.get(_tag_key(slug))
+    record_cache(tag is not None)
+    if tag is None:
+        tag = Tag.objects.filter(slug=slug).first()
+        if tag is not None:
+            cache.set(_tag_key(slug), tag, PAGE_CACHE_TIMEOUT)
+    return tag
+
+
+def forget_tag(slug):
+    cache.delete(_tag_key(slug))
+
+
+def page_cache_key(view_name, namespaces, request):
+    stamp = ':'.join(
+        str(generation) for generation in request_generations(request, namespaces)
+    )
+    # Namespaces bumped together share a generation, so the path tells apart
+    # e.g. two posts invalidated by the same write
+    url = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'blog:response:{view_name}:{stamp}:{url}'
+
+
+def cacheable(response):
+    # Feeds and sitemaps are not HTML, so keep the content type too
+    return response.content, response.headers['Content-Type']
+
+
+def cached_response(cached):
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+def cached_value(name, namespaces, compute):
+    """compute(), cached until any of `namespaces` is bumped."""
+    stamps = generations(*namespaces)
+    key = f'blog:value:{name}:' + ':'.join(str(stamp) for stamp in stamps)
+    value = cache.get(key)
+    record_cache(value is not None)
+    if value is None:
+        value = compute()
+        if settled(stamps):
+            cache.set(key, value, PAGE_CACHE_TIMEOUT)
+    return value
+
+
+def cache_anonymous_page(namespaces_func):
+    """
+    Cache the rendered page for anonymous GET requests.
+
+    `namespaces_func(**view_kwargs)` names the generations the page depends
+    on; bumping any of them makes the cached copy unreachable.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                user = await request.auser()
+                if request.method != 'GET' or user.is_authenticated:
+                    return await view_func(request, *args, **kwargs)
+
+                namespaces = namespaces_func(**kwargs)
+                key = await sync_to_async(page_cache_key)(
+                    view_func.__name__, namespaces, request
+                )
+                cached = await cache.aget(key)
+                record_cache(cached is not None)
+                if cached is not None:
+                    return cached_response(cached)
+
+                response = await view_func(request, *args, **kwargs)
+                if (
+                    response.status_code == 200 and not response.streaming
+                    and settled(request_generations(request, namespaces))
+                ):
+                    await cache.aset(key, cacheable(response), PAGE_CACHE_TIMEOUT)
+                return response
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view_func(request, *args, **kwargs)
+
+            namespaces = namespaces_func(**kwargs)
+            key = page_cache_key(view_func.__name__, namespaces, request)
+            cached = cache.get(key)
+            record_cache(cached is not None)
+            if cached is not None:
+                return cached_response(cached)
+
+            response = view_func(request, *args, **kwargs)
+            if (
+                response.status_code == 200 and not response.streaming
+                and settled(request_generations(request, namespaces))
+            ):
+                cache.set(key, cacheable(response), PAGE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_page(namespaces_func):
+    """
+    Answer If-None-Match / If-Modified-Since from the cached generations.
+
+    Validators cost a single cache round trip and no queries, so a 304 is
+    returned before the view touches the database or renders anything.
+    Pages that may be read from a lagging replica get no validators.
+    """
+    def etag(request, *args, **kwargs):
+        stamps = request_generations(request, namespaces_func(**kwargs))
+        if not settled(stamps):
+            return None
+        stamp = ':'.join(str(generation) for generation in stamps)
+        user = request.user
+        viewer = (
+            f'{user.pk}:{user.get_username()}:{user.first_name}'
+            if user.is_authenticated else 'anonymous'
+        )
+        seed = f'{stamp}|{viewer}|{request.GET.urlencode()}'
+        return hashlib.md5(seed.encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        stamps = request_generations(request, namespaces_func(**kwargs))
+        if not settled(stamps):
+            return None
+        return datetime.fromtimestamp(max(stamps) / 1e9, tz=timezone.utc)
+
+    def decorator(view_func):
+        if not iscoroutinefunction(view_func):
+            return condition(etag_func=etag, last_modified_func=last_modified)(view_func)
+
+        # Same as condition(), with the validators (session user and cache
+        # lookups) moved off the event loop.
+        def validators(request, *args, **kwargs):
+            res_etag = etag(request, *args, **kwargs)
+            if res_etag is None:
+                return None, None
+            return (
+                quote_etag(res_etag),
+                int(last_modified(request, *args, **kwargs).timestamp()),
+            )
+
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            # Resolve the user once; request.user and request.auser() would
+            # otherwise each load it separately.
+            request.user = await request.auser()
+            res_etag, res_last_modified = await sync_to_async(validators)(
+                request, *args, **kwargs
+            )
+            response = get_conditional_response(
+                request, etag=res_etag, last_modified=res_last_modified
+            )
+            if response is None:
+                response = await view_func(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD') and res_etag is not None:
+                if not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(res_last_modified)
+                response.headers.setdefault('ETag', res_etag)
+            return response
+        return async_wrapper
+    return decorator
@@ -0,0 +1,68 @@
+from django.contrib.syndication.views import Feed
+from django.http import Http404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+
+from .cache import get_tag
+from .models import Post
+
+FEED_ITEMS = 20
+
+
+class LatestPostsFeed(Feed):
+    """Latest published posts, optionally for one tag, as RSS 2.0."""
+
+    def get_object(self, request, tag_slug=None):
+        if tag_slug is None:
+            return None
+        tag = get_tag(tag_slug)
+        if tag is None:
+            raise Http404('No Tag matches the given query.')
+        return tag
+
+    def title(self, tag):
+        return f'My blog: posts tagged "{tag.name}"' if tag else 'My blog'
+
+    def link(self, tag):
+        if tag:
+            return reverse('blog:post_list_by_tag', args=[tag.slug])
+        return reverse('blog:post_list')
+
+    def description(self, tag):
+        return f'New posts tagged "{tag.name}"' if tag else 'New posts on my blog'
+
+    def items(self, tag):
+        posts = (
+            Post.published.select_related('author')
+            .prefetch_related('tags')
+            .defer('content', 'search_vector')
+        )
+        if tag:
+            posts = posts.filter(tags__in=[tag])
+        return posts[:FEED_ITEMS]
+
+    def item_title(self, item):
+        return item.title
+
+    def item_description(self, item):
+        # The stored HTML; feeds never run the Markdown renderer
+        return item.content_html
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.get_username()
+
+    def item_pubdate(self, item):
+        return item.created
+
+    def item_updateddate(self, item):
+        return item.updated
+
+    def item_categories(self, item):
+        return [tag.name for tag in item.tags.all()]
+
+
+class AtomLatestPostsFeed(LatestPostsFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, tag):
+        return self.description(tag)
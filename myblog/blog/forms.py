@@ -1,7 +1,6 @@
 from django.contrib.auth import get_user_model
 from django import forms
-from django.utils.text import slugify
-from .models import Comment, Post, Profile
+from .models import Comment, Post, Profile, allocate_slugs
 
 User = get_user_model()
 
@@ -25,17 +24,11 @@ class PostForm(forms.ModelForm):
         post = super().save(commit=False)
 
         if not post.slug:
-            base_slug = slugify(post.title)
-            slug = base_slug
-            counter = 1
-
-            while Post.objects.filter(slug=slug).exclude(pk=post.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            post.slug = slug
+            post.slug = allocate_slugs([post.title], exclude_pk=post.pk)[0]
 
         if commit:
             post.save()
+            self._save_m2m()
 
         return post
 
@@ -79,7 +72,8 @@ class UserRegistrationForm(forms.ModelForm):
 
     def clean_email(self):
         data = self.cleaned_data['email']
-        if User.objects.filter(email=data).exists():
+        # Served by the UPPER(email) index on auth_user
+        if User.objects.filter(email__iexact=data).exists():
             raise forms.ValidationError('Email already in use.')
         return data
 
@@ -91,10 +85,12 @@ class UserEditForm(forms.ModelForm):
 
     def clean_email(self):
         data = self.cleaned_data['email']
+        if 'email' not in self.changed_data:
+            return data
         qs = User.objects.exclude(
             id=self.instance.id
         ).filter(
-            email=data
+            email__iexact=data
         )
         if qs.exists():
             raise forms.ValidationError('Email already in use.')
@@ -0,0 +1,198 @@
+import itertools
+import json
+import math
+import random
+import statistics
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from taggit.models import Tag
+
+from blog.models import Comment, Post
+from blog.management.commands.seed_corpus import WORDS
+
+User = get_user_model()
+
+SCENARIOS = [
+    'post_list', 'tag_list', 'post_detail', 'search', 'suggest', 'post_create', 'comment',
+]
+
+
+def percentile(cuts, p):
+    return cuts[p - 1] * 1000 if cuts else 0.0
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the blog URLs through the test client against the seeded '
+        'corpus (see seed_corpus) and report latency, throughput and query '
+        'counts as JSON. Writes are rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=SCENARIOS,
+            help='Run only these scenarios (repeatable).',
+        )
+        parser.add_argument(
+            '--with-cache',
+            action='store_true',
+            help='Keep the page cache; by default every request reaches the database.',
+        )
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.slugs = list(
+            Post.published.order_by('?').values_list('slug', flat=True)[:1000]
+        )
+        self.tag_slugs = list(
+            Tag.objects.filter(stat__published_count__gt=0)
+            .order_by('?').values_list('slug', flat=True)[:200]
+        )
+        if not self.slugs or not self.tag_slugs:
+            raise CommandError('No published, tagged posts; run seed_corpus first.')
+
+        caches = {}
+        if not options['with_cache']:
+            caches['CACHES'] = {
+                'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+            }
+
+        report = {
+            'commit': git_commit(),
+            'django': django.get_version(),
+            'dataset': {
+                'posts': Post.objects.count(),
+                'comments': Comment.objects.count(),
+                'tags': Tag.objects.count(),
+            },
+            'options': {
+                key: options[key] for key in ('requests', 'warmup', 'seed', 'with_cache')
+            },
+            'scenarios': {},
+        }
+        with override_settings(**caches):
+            try:
+                with transaction.atomic():
+                    self.client = self.logged_in_client('benchmark-writer')
+                    scenarios = options['scenario'] or SCENARIOS
+                    if 'comment' in scenarios:
+                        self.commenters = self.commenter_clients(
+                            options['warmup'] + options['requests']
+                        )
+                    for name in scenarios:
+                        report['scenarios'][name] = self.run_scenario(
+                            name, options['warmup'], options['requests']
+                        )
+                    raise Rollback
+            except Rollback:
+                pass
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+    def logged_in_client(self, username):
+        user = User.objects.create_user(username, password='benchmark')
+        client = Client(SERVER_NAME='localhost')
+        client.force_login(user)
+        return client
+
+    def commenter_clients(self, comments):
+        # Enough users that none goes over BLOG_COMMENT_RATE, which applies
+        # whenever the cache is real
+        limit, _ = settings.BLOG_COMMENT_RATE
+        return itertools.cycle([
+            self.logged_in_client(f'benchmark-commenter-{i}')
+            for i in range(math.ceil(comments / limit))
+        ])
+
+    def request(self, name):
+        if name == 'post_list':
+            return self.anonymous.get(reverse('blog:post_list'))
+        if name == 'tag_list':
+            return self.anonymous.get(
+                reverse('blog:post_list_by_tag', args=[self.rng.choice(self.tag_slugs)])
+            )
+        if name == 'post_detail':
+            return self.anonymous.get(
+                reverse('blog:post_detail', args=[self.rng.choice(self.slugs)])
+            )
+        if name == 'search':
+            query = ' '.join(self.rng.sample(WORDS, 2))
+            return self.anonymous.get(reverse('blog:post_search'), {'query': query})
+        if name == 'suggest':
+            # A keystroke: the first three to eight letters of a word
+            word = self.rng.choice(WORDS)
+            prefix = word[:self.rng.randint(3, max(3, len(word)))]
+            return self.anonymous.get(reverse('blog:post_suggest'), {'q': prefix})
+        if name == 'post_create':
+            return self.client.post(reverse('blog:post_create'), {
+                'title': f'Benchmark {self.rng.random()}',
+                'content': 'Some *Markdown* with `code`.',
+                'tags': ', '.join(self.rng.sample(WORDS, 2)),
+                'status': 'published',
+            })
+        if name == 'comment':
+            return next(self.commenters).post(
+                reverse('blog:post_detail', args=[self.rng.choice(self.slugs)]),
+                {'content': 'A benchmark comment.'},
+            )
+        raise CommandError(f'Unknown scenario "{name}".')
+
+    def run_scenario(self, name, warmup, total):
+        self.anonymous = Client(SERVER_NAME='localhost')
+        for _ in range(warmup):
+            self.request(name)
+
+        latencies, queries = [], []
+        started = time.perf_counter()
+        for _ in range(total):
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = self.request(name)
+                latencies.append(time.perf_counter() - request_started)
+            if response.status_code >= 400:
+                raise CommandError(f'{name} answered {response.status_code}.')
+            queries.append(len(captured))
+        elapsed = time.perf_counter() - started
+
+        cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+        return {
+            'requests': total,
+            'rps': round(total / elapsed, 1),
+            'p50_ms': round(percentile(cuts, 50), 2),
+            'p95_ms': round(percentile(cuts, 95), 2),
+            'p99_ms': round(percentile(cuts, 99), 2),
+            'queries_median': statistics.median(queries),
+            'queries_max': max(queries),
+        }
@@ -0,0 +1,101 @@
+import asyncio
+import inspect
+import json
+import statistics
+import time
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import AsyncRequestFactory
+
+from blog import async_views, views
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare sync and async read views at a fixed concurrency, '
+        'the way the ASGI handler runs them (page cache bypassed)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--query', default='django')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    def handle(self, *args, **options):
+        post = Post.published.only('slug').first()
+        if post is None:
+            raise CommandError('Needs at least one published post.')
+
+        endpoints = [
+            ('post_list', '/blog/', {}),
+            ('post_detail', post.get_absolute_url(), {'slug': post.slug}),
+            ('post_search', '/blog/search/', {}),
+        ]
+        results = []
+        for name, path, kwargs in endpoints:
+            data = {'query': options['query']} if name == 'post_search' else None
+            for mode, module in (('sync', views), ('async', async_views)):
+                # Skip the conditional-GET and page-cache decorators so every
+                # request reaches the database.
+                view = inspect.unwrap(getattr(module, name))
+                latencies, elapsed = asyncio.run(self.run(
+                    view, path, data, kwargs,
+                    options['concurrency'], options['requests'],
+                ))
+                results.append(self.summary(name, mode, latencies, elapsed))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for row in results:
+            self.stdout.write(
+                f"{row['view']:<12} {row['mode']:<6} {row['rps']:>8.1f} req/s  "
+                f"p50 {row['p50_ms']:>7.1f} ms  p95 {row['p95_ms']:>7.1f} ms"
+            )
+
+    async def run(self, view, path, data, kwargs, concurrency, total):
+        factory = AsyncRequestFactory()
+        limit = asyncio.Semaphore(concurrency)
+        is_async = inspect.iscoroutinefunction(view)
+        latencies = []
+
+        async def one():
+            async with limit:
+                request = factory.get(path, data)
+                request.user = AnonymousUser()
+
+                async def auser():
+                    return request.user
+
+                request.auser = auser
+                started = time.perf_counter()
+                # One thread per request for sync work, as ASGIHandler does.
+                async with ThreadSensitiveContext():
+                    if is_async:
+                        await view(request, **kwargs)
+                    else:
+                        await sync_to_async(view)(request, **kwargs)
+                    # What request_finished does for this request's thread
+                    await sync_to_async(close_old_connections)()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return latencies, time.perf_counter() - started
+
+    @staticmethod
+    def summary(name, mode, latencies, elapsed):
+        cuts = statistics.quantiles(latencies, n=100)
+        return {
+            'view': name,
+            'mode': mode,
+            'requests': len(latencies),
+            'rps': len(latencies) / elapsed,
+            'p50_ms': cuts[49] * 1000,
+            'p95_ms': cuts[94] * 1000,
+        }
@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Profile
+from blog.thumbnails import thumbnail_task
+
+
+class Command(BaseCommand):
+    help = 'Build resized variants for profile photos that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild variants for every photo, not only missing ones.',
+        )
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(photo='')
+        if not options['all']:
+            profiles = profiles.filter(thumbnails={})
+
+        built = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {
+                pool.submit(thumbnail_task, pk, photo): photo
+                for pk, photo in profiles.values_list('pk', 'photo').iterator()
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {exc}')
+                else:
+                    built += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Built thumbnails for {built} photo(s), {failed} failed.'
+        ))
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from itertools import repeat
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Count, Max
+from django.test import Client
+from django.urls import reverse
+
+from blog.models import MonthStat, Post, RelatedPost, TagStat
+from blog.staticfiles import compress
+
+MANIFEST = 'export-manifest.json'
+
+
+def write_atomic(path, data):
+    """Write `data` to `path` through a rename, so readers never see half a file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def page_paths(root, url):
+    """The file a URL is exported to and its gzipped copy."""
+    path = Path(root, url.strip('/'), 'index.html')
+    return path, path.with_name('index.html.gz')
+
+
+def default_host():
+    hosts = [host for host in settings.ALLOWED_HOSTS if host[0] not in '.*']
+    return hosts[0] if hosts else 'localhost'
+
+
+def render_pages(root, host, urls):
+    """Export `urls` as an anonymous visitor sees them; returns those that rendered."""
+    # A failing view is counted as a failed page, not raised
+    client = Client(SERVER_NAME=host, raise_request_exception=False)
+    done = []
+    for url in urls:
+        response = client.get(url)
+        if response.status_code != 200:
+            continue
+        html, gz = page_paths(root, url)
+        write_atomic(gz, compress(response.content, 'gzip'))
+        write_atomic(html, response.content)
+        done.append(url)
+    return done
+
+
+def render_batch(root, host, urls):
+    # Runs on a pool process, which outlives any request cycle that would
+    # close its connections
+    try:
+        return render_pages(root, host, urls)
+    finally:
+        connections.close_all()
+
+
+def version(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def related_versions():
+    """{post id: [(related id, its last edit)]}, the related list of each post."""
+    lists = defaultdict(list)
+    rows = RelatedPost.objects.order_by('post', 'rank').values_list(
+        'post_id', 'related_id', 'related__updated'
+    )
+    for post_id, related_id, updated in rows.iterator(chunk_size=5000):
+        lists[post_id].append((related_id, updated))
+    return lists
+
+
+def page_versions():
+    """
+    {url: version} for every page to export. A version changes whenever the
+    page can: a post's own edits, approved comments, related posts and
+    rendered HTML (re-rendered by `rerender_posts` without an edit), and
+    for list pages the latest edit and number of the posts they cover plus
+    the counts in the tag cloud and archive sidebars.
+    """
+    sidebars = version(
+        list(TagStat.objects.filter(published_count__gt=0)
+             .order_by('tag_id').values_list('tag__name', 'published_count')),
+        list(MonthStat.objects.filter(published_count__gt=0)
+             .values_list('month', 'published_count')),
+    )
+    posts = Post.published.exclude(slug='')
+    latest = posts.aggregate(updated=Max('updated'), count=Count('pk'))
+    versions = {
+        reverse('blog:post_list'): version(latest['updated'], latest['count'], sidebars),
+    }
+
+    tags = (
+        posts.filter(tags__isnull=False)
+        .values('tags__slug')
+        .annotate(latest=Max('updated'), count=Count('pk'))
+        .order_by()
+        .values_list('tags__slug', 'latest', 'count')
+    )
+    for slug, updated, count in tags:
+        versions[reverse('blog:post_list_by_tag', args=[slug])] = version(
+            updated, count, sidebars
+        )
+
+    related = related_versions()
+    rows = posts.order_by().values_list(
+        'pk', 'slug', 'updated', 'approved_comment_count', 'content_hash', 'renderer_version'
+    )
+    for pk, slug, updated, comments, *rendered in rows.iterator(chunk_size=5000):
+        versions[reverse('blog:post_detail', args=[slug])] = version(
+            updated, comments, related.get(pk), rendered
+        )
+    return versions
+
+
+class Command(BaseCommand):
+    help = (
+        'Export the post list, tag pages and published posts as static HTML '
+        '(plus .gz copies) for a web server or CDN. Only pages that changed '
+        'since the last export are rendered again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir')
+        parser.add_argument(
+            '--host',
+            default=default_host(),
+            help='Host name the pages are rendered for (default: from ALLOWED_HOSTS).',
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Render every page, ignoring the previous manifest.',
+        )
+
+    def handle(self, *args, **options):
+        root = Path(options['output_dir'])
+        manifest_path = root / MANIFEST
+        previous = {}
+        if manifest_path.exists():
+            previous = json.loads(manifest_path.read_text())['pages']
+
+        versions = page_versions()
+        stale = [
+            url for url, current in versions.items()
+            if options['all'] or previous.get(url) != current
+        ]
+        removed = [url for url in previous if url not in versions]
+        for url in removed:
+            for path in page_paths(root, url):
+                path.unlink(missing_ok=True)
+            with suppress(OSError):
+                path.parent.rmdir()
+
+        host = options['host']
+        size = options['batch_size']
+        batches = [stale[i:i + size] for i in range(0, len(stale), size)]
+        rendered = []
+        if options['workers'] > 1:
+            # Forked workers must not inherit this process's open connections
+            connections.close_all()
+            with ProcessPoolExecutor(options['workers'], initializer=django.setup) as pool:
+                for done in pool.map(render_batch, repeat(str(root)), repeat(host), batches):
+                    rendered += done
+                    self.progress(len(rendered), len(stale), options['verbosity'])
+        else:
+            for batch in batches:
+                rendered += render_pages(root, host, batch)
+                self.progress(len(rendered), len(stale), options['verbosity'])
+
+        # Pages that failed stay out of the manifest and are retried next time
+        stale = set(stale)
+        pages = {
+            url: current for url, current in previous.items()
+            if url in versions and url not in stale
+        }
+        pages.update({url: versions[url] for url in rendered})
+        write_atomic(manifest_path, json.dumps({'pages': pages}).encode())
+
+        failed = len(stale) - len(rendered)
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {len(rendered)} page(s), removed {len(removed)}, {failed} failed.'
+        ))
+
+    def progress(self, done, total, verbosity):
+        if verbosity > 1:
+            self.stdout.write(f'{done}/{total} pages')
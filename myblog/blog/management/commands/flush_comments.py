@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from blog.comment_queue import flush, get_queue
+
+
+class Command(BaseCommand):
+    help = 'Save queued comments in batches (see BLOG_COMMENT_QUEUE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running, polling the queue when it is empty.',
+        )
+        parser.add_argument('--interval', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        if queue is None:
+            raise CommandError('BLOG_COMMENT_QUEUE is not set.')
+
+        total = 0
+        while True:
+            flushed = flush(queue, options['batch_size'])
+            total += flushed
+            if flushed and options['verbosity'] > 1:
+                self.stdout.write(f'Flushed {flushed} comment(s)')
+            if flushed:
+                continue
+            if not options['loop']:
+                break
+            # Don't hold a connection open while idle
+            close_old_connections()
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Flushed {total} queued comment(s).'))
@@ -0,0 +1,207 @@
+import json
+import sys
+import time
+from collections import Counter
+from itertools import islice
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag, TaggedItem
+
+from blog.cache import bump
+from blog.models import Post, adjust_month_stats, adjust_tag_stats, allocate_slugs, month_of
+from blog.related import schedule_refresh
+
+User = get_user_model()
+
+
+def parse_markdown(path):
+    """
+    Read a Markdown file with optional `key: value` front matter between
+    `---` lines. The title falls back to the first `# ` heading.
+    """
+    text = Path(path).read_text(encoding='utf-8')
+    record = {}
+    if text.startswith('---\n'):
+        front, _, text = text[4:].partition('\n---\n')
+        for line in front.splitlines():
+            key, sep, value = line.partition(':')
+            if sep:
+                record[key.strip()] = value.strip()
+    if 'title' not in record:
+        for line in text.splitlines():
+            if line.startswith('# '):
+                record['title'] = line[2:].strip()
+                break
+    record['content'] = text.lstrip('\n')
+    return record
+
+
+def read_records(sources):
+    """Yield one dict per post without loading the whole input in memory."""
+    for source in sources:
+        if source == '-':
+            for line in sys.stdin:
+                if line.strip():
+                    yield json.loads(line)
+            continue
+
+        path = Path(source)
+        if path.is_dir():
+            for md_file in sorted(path.rglob('*.md')):
+                yield parse_markdown(md_file)
+        elif path.suffix == '.md':
+            yield parse_markdown(path)
+        else:
+            with path.open(encoding='utf-8') as lines:
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+
+
+def tag_names(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    return [name.strip() for name in value or [] if name.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Bulk import posts from JSONL files, Markdown files or directories'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sources',
+            nargs='+',
+            help='JSONL files, .md files or directories of .md files; "-" reads JSONL from stdin.',
+        )
+        parser.add_argument(
+            '--author',
+            help='Username used for records without an "author".',
+        )
+        parser.add_argument(
+            '--status',
+            choices=[choice for choice, _ in Post.STATUS_CHOICES],
+            default='draft',
+            help='Status used for records without a "status".',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        default_author = None
+        if options['author']:
+            try:
+                default_author = User.objects.get(username=options['author'])
+            except User.DoesNotExist:
+                raise CommandError(f'Unknown author "{options["author"]}".')
+
+        self.content_type = ContentType.objects.get_for_model(Post)
+        records = read_records(options['sources'])
+        imported = 0
+        started = time.monotonic()
+
+        while batch := list(islice(records, options['batch_size'])):
+            with transaction.atomic():
+                imported += self.import_batch(batch, default_author, options['status'])
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f'{imported} posts, {imported / (time.monotonic() - started):.0f}/s'
+                )
+
+        # bulk_create sends no signals; drop every cached list page at once.
+        bump('lists', 'list')
+
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} post(s) in {elapsed:.1f}s ({rate:.0f} posts/s).'
+        ))
+
+    def import_batch(self, records, default_author, default_status):
+        usernames = {record['author'] for record in records if record.get('author')}
+        authors = {user.username: user for user in User.objects.filter(username__in=usernames)}
+
+        statuses = {choice for choice, _ in Post.STATUS_CHOICES}
+        posts = []
+        for record in records:
+            if not record.get('title'):
+                raise CommandError(f'Record without a title: {record!r:.80}')
+            author = authors.get(record.get('author')) or default_author
+            if author is None:
+                raise CommandError(f'No author for "{record["title"]}"; pass --author.')
+            status = record.get('status', default_status)
+            if status not in statuses:
+                raise CommandError(f'Bad status {status!r} for "{record["title"]}".')
+            post = Post(
+                title=record['title'],
+                content=record.get('content', ''),
+                author=author,
+                status=status,
+            )
+            post.render_content()
+            posts.append(post)
+
+        for post, slug in zip(posts, allocate_slugs([post.title for post in posts])):
+            post.slug = slug
+        Post.objects.bulk_create(posts)
+
+        # auto_now_add overrides dates on insert; restore the original ones.
+        dated = []
+        for post, record in zip(posts, records):
+            if record.get('created'):
+                post.created = parse_datetime(record['created'])
+                if post.created is None:
+                    raise CommandError(f'Bad "created" date: {record["created"]!r}')
+                if timezone.is_naive(post.created):
+                    post.created = timezone.make_aware(post.created)
+                dated.append(post)
+        if dated:
+            Post.objects.bulk_update(dated, ['created'])
+        adjust_month_stats(Counter(
+            month_of(post.created) for post in posts if post.status == 'published'
+        ))
+
+        self.tag_posts(posts, [tag_names(record.get('tags')) for record in records])
+        schedule_refresh([post.pk for post in posts if post.status == 'published'])
+        return len(posts)
+
+    def tag_posts(self, posts, names_per_post):
+        names = {name for names in names_per_post for name in names}
+        if not names:
+            return
+
+        tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+        missing = names - set(tags)
+        if missing:
+            Tag.objects.bulk_create(
+                [Tag(name=name, slug=Tag().slugify(name)) for name in missing],
+                ignore_conflicts=True,
+            )
+            tags.update(
+                (tag.name, tag) for tag in Tag.objects.filter(name__in=missing)
+            )
+            # Names whose slug clashed with another tag go through taggit's
+            # own slug de-duplication.
+            for name in missing - set(tags):
+                tags[name], _ = Tag.objects.get_or_create(name=name)
+
+        tagged_items = [
+            TaggedItem(
+                tag=tags[name],
+                content_type=self.content_type,
+                object_id=post.pk,
+            )
+            for post, post_names in zip(posts, names_per_post)
+            for name in set(post_names)
+        ]
+        TaggedItem.objects.bulk_create(tagged_items)
+
+        published = {post.pk for post in posts if post.status == 'published'}
+        deltas = Counter(
+            item.tag_id for item in tagged_items if item.object_id in published
+        )
+        adjust_tag_stats(deltas)
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from blog.cache import bump
+from blog.models import Post, RelatedPost
+from blog.related import rebuild
+
+
+def rebuild_batch(post_ids):
+    # Runs on a pool thread with its own connection
+    close_old_connections()
+    try:
+        rebuild(post_ids)
+    finally:
+        close_old_connections()
+    return len(post_ids)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related posts of every published post'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        size = options['batch_size']
+        self.verbosity = options['verbosity']
+        post_ids = list(Post.published.order_by('pk').values_list('pk', flat=True))
+        # Lists of posts that are no longer published
+        RelatedPost.objects.exclude(post__status='published').delete()
+
+        batches = [post_ids[i:i + size] for i in range(0, len(post_ids), size)]
+        done = 0
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                for count in pool.map(rebuild_batch, batches):
+                    done += count
+                    self.progress(done, len(post_ids))
+        else:
+            # In this thread and connection, e.g. inside a transaction
+            for batch in batches:
+                rebuild(batch)
+                done += len(batch)
+                self.progress(done, len(post_ids))
+
+        # Every detail page may show a different list now
+        slugs = list(Post.published.values_list('slug', flat=True))
+        for i in range(0, len(slugs), size):
+            bump(*[f'post:{slug}' for slug in slugs[i:i + size]])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt related posts for {done} post(s).'))
+
+    def progress(self, done, total):
+        if self.verbosity > 1:
+            self.stdout.write(f'{done}/{total} posts')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from blog.cache import bump
+from blog.models import MonthStat, TagStat, refresh_month_stats, refresh_tag_stats
+
+
+class Command(BaseCommand):
+    help = 'Recount published posts per tag and per month from scratch'
+
+    def handle(self, *args, **options):
+        refresh_tag_stats()
+        refresh_month_stats()
+        bump('lists', 'list')
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt stats for {TagStat.objects.count()} tag(s) '
+            f'and {MonthStat.objects.count()} month(s).'
+        ))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from blog.cache import bump
+from blog.models import Post
+
+RENDER_FIELDS = ['content_html', 'content_hash', 'renderer_version']
+
+
+class Command(BaseCommand):
+    help = 'Re-render stored Markdown HTML for posts with a stale renderer or content hash'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Re-render every post, not only stale ones.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Every row is read because a stale content hash can only be detected
+        # against the content itself; only stale rows are written back.
+        posts = Post.objects.only('id', 'slug', 'content', *RENDER_FIELDS).order_by('pk')
+
+        batch = []
+        rendered = 0
+        for post in posts.iterator(chunk_size=batch_size):
+            if post.render_content(force=options['all']):
+                batch.append(post)
+            if len(batch) >= batch_size:
+                rendered += self.store(batch)
+                batch = []
+        if batch:
+            rendered += self.store(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Re-rendered {rendered} post(s).'))
+
+    def store(self, posts):
+        Post.objects.bulk_update(posts, RENDER_FIELDS)
+        # bulk_update sends no signals; feeds show the HTML too, hence 'list'
+        bump('list', *[f'post:{post.slug}' for post in posts])
+        return len(posts)
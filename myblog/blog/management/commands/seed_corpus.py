@@ -0,0 +1,198 @@
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F, Value
+from django.db.models.functions import Now
+from taggit.models import Tag, TaggedItem
+
+from blog.cache import bump
+from blog.models import Comment, Post, refresh_month_stats, refresh_tag_stats
+from blog.rendering import content_hash, render_markdown, renderer_version
+
+User = get_user_model()
+
+SLUG_PREFIX = 'bench-'
+
+WORDS = (
+    'django python postgres index query cache cursor page render template '
+    'markdown search vector async thread pool latency throughput benchmark '
+    'request response header static asset compress migration model field '
+    'signal counter tag comment author draft publish slug replica router'
+).split()
+
+CODE_SAMPLES = [
+    "def handler(request):\n    return HttpResponse('ok')",
+    "SELECT id, title FROM blog_post\nWHERE status = 'published'\nORDER BY created DESC\nLIMIT 10;",
+    "for post in Post.published.select_related('author'):\n    print(post.title)",
+]
+
+
+def sentence(rng, length):
+    words = rng.choices(WORDS, k=length)
+    return ' '.join(words).capitalize() + '.'
+
+
+def markdown_body(rng):
+    parts = [f'# {sentence(rng, 5)}']
+    for _ in range(rng.randint(3, 8)):
+        parts.append(' '.join(
+            sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(2, 5))
+        ))
+        if rng.random() < 0.4:
+            parts.append(f'```python\n{rng.choice(CODE_SAMPLES)}\n```')
+        if rng.random() < 0.2:
+            parts.append('\n'.join(f'- {sentence(rng, 4)}' for _ in range(rng.randint(2, 5))))
+    return '\n\n'.join(parts)
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a reproducible synthetic corpus for the benchmark command. '
+        'Run it against a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100_000)
+        parser.add_argument('--comments', type=int, default=1_000_000)
+        parser.add_argument('--tags', type=int, default=5_000)
+        parser.add_argument('--authors', type=int, default=50)
+        parser.add_argument('--tags-per-post', type=int, default=3)
+        parser.add_argument(
+            '--bodies',
+            type=int,
+            default=200,
+            help='Distinct Markdown bodies; each is rendered once and reused.',
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Threads computing the related posts of the seeded posts.',
+        )
+
+    def handle(self, *args, **options):
+        if Post.objects.filter(slug__startswith=SLUG_PREFIX).exists():
+            raise CommandError('A corpus is already seeded; use a fresh database.')
+
+        rng = random.Random(options['seed'])
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        with transaction.atomic():
+            authors = self.seed_authors(options['authors'])
+            tags = self.seed_tags(options['tags'])
+            posts = self.seed_posts(
+                rng, options['posts'], options['comments'], authors, options['bodies']
+            )
+            self.seed_taggings(rng, posts, tags, options['tags_per_post'])
+            self.seed_comments(rng, posts, authors)
+            refresh_tag_stats()
+            refresh_month_stats()
+            bump('lists', 'list')
+        # After the commit, so worker threads see the seeded posts
+        call_command(
+            'rebuild_related_posts', workers=options['workers'],
+            verbosity=self.verbosity, stdout=self.stdout,
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(posts)} posts, {options["comments"]} comments and '
+            f'{len(tags)} tags in {time.monotonic() - started:.1f}s.'
+        ))
+
+    def log(self, message):
+        if self.verbosity > 1:
+            self.stdout.write(message)
+
+    def seed_authors(self, count):
+        User.objects.bulk_create(
+            [User(username=f'{SLUG_PREFIX}author-{i}') for i in range(count)],
+            ignore_conflicts=True,
+        )
+        return list(User.objects.filter(username__startswith=f'{SLUG_PREFIX}author-'))
+
+    def seed_tags(self, count):
+        Tag.objects.bulk_create(
+            [Tag(name=f'topic {i}', slug=f'topic-{i}') for i in range(count)],
+            ignore_conflicts=True,
+            batch_size=self.batch_size,
+        )
+        return list(Tag.objects.filter(slug__startswith='topic-').only('pk'))
+
+    def seed_posts(self, rng, count, comment_count, authors, body_count):
+        version = renderer_version()
+        bodies = []
+        for _ in range(body_count):
+            text = markdown_body(rng)
+            bodies.append((text, render_markdown(text), content_hash(text)))
+
+        # Decide where every comment goes up front, so the denormalized
+        # counts are inserted with the posts instead of updated afterwards.
+        self.comment_posts = [rng.randrange(count) for _ in range(comment_count)]
+        self.comment_approved = [rng.random() < 0.8 for _ in range(comment_count)]
+        approved = Counter(
+            index for index, ok in zip(self.comment_posts, self.comment_approved) if ok
+        )
+
+        posts = []
+        for i in range(count):
+            text, html, digest = bodies[i % len(bodies)]
+            posts.append(Post(
+                title=sentence(rng, rng.randint(3, 9))[:-1],
+                slug=f'{SLUG_PREFIX}{i}',
+                author=rng.choice(authors),
+                content=text,
+                content_html=html,
+                content_hash=digest,
+                renderer_version=version,
+                status='published' if rng.random() < 0.9 else 'draft',
+                approved_comment_count=approved[i],
+            ))
+        Post.objects.bulk_create(posts, batch_size=self.batch_size)
+        self.log(f'{len(posts)} posts')
+
+        # auto_now_add stamps every row alike; spread them ten minutes apart.
+        last_id = posts[-1].pk
+        Post.objects.filter(slug__startswith=SLUG_PREFIX).update(created=ExpressionWrapper(
+            Now() - (Value(last_id) - F('id')) * Value(timedelta(minutes=10)),
+            output_field=DateTimeField(),
+        ))
+        return posts
+
+    def seed_taggings(self, rng, posts, tags, per_post):
+        content_type = ContentType.objects.get_for_model(Post)
+        items = [
+            TaggedItem(tag=tag, content_type=content_type, object_id=post.pk)
+            for post in posts
+            for tag in rng.sample(tags, min(per_post, len(tags)))
+        ]
+        TaggedItem.objects.bulk_create(items, batch_size=self.batch_size)
+        self.log(f'{len(items)} taggings')
+
+    def seed_comments(self, rng, posts, authors):
+        batch = []
+        inserted = 0
+        for index, approved in zip(self.comment_posts, self.comment_approved):
+            batch.append(Comment(
+                post_id=posts[index].pk,
+                author=rng.choice(authors),
+                content=sentence(rng, rng.randint(5, 30)),
+                approved=approved,
+            ))
+            if len(batch) >= self.batch_size:
+                Comment.objects.bulk_create(batch)
+                inserted += len(batch)
+                self.log(f'{inserted} comments')
+                batch = []
+        if batch:
+            Comment.objects.bulk_create(batch)
@@ -0,0 +1,246 @@
+"""
+Per-request performance metrics.
+
+With BLOG_METRICS on, MetricsMiddleware collects the query count and time,
+template and Markdown render time and cache hits of each request, sends
+them back in a Server-Timing header and adds them to per-view histograms
+exposed at /metrics in the Prometheus text format. With it off the
+middleware is not loaded and the hooks below reduce to a ContextVar lookup.
+"""
+import hmac
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.template.backends import django as django_backend
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Server-Timing names of the timed phases
+TIMINGS = {
+    'db': 'Database',
+    'template': 'Templates',
+    'markdown': 'Markdown',
+}
+
+_current = ContextVar('blog_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.timings = defaultdict(float)
+        self.cache = Counter()
+
+
+def add_time(name, seconds):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.timings[name] += seconds
+
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - started)
+
+
+def record_cache(hit):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache['hit' if hit else 'miss'] += 1
+
+
+def instrument_queries(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.timings['db'] += time.perf_counter() - started
+
+
+def install_query_hook(sender=None, connection=None, **kwargs):
+    if instrument_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(instrument_queries)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, timing each top-level render."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except django_backend.TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms and counters keyed by metric name and view."""
+
+    HISTOGRAMS = {
+        'blog_request_duration_seconds': ('Request duration', DURATION_BUCKETS),
+        'blog_db_queries': ('SQL queries per request', QUERY_COUNT_BUCKETS),
+        'blog_db_duration_seconds': ('Time in SQL queries per request', DURATION_BUCKETS),
+        'blog_template_duration_seconds': ('Template render time per request', DURATION_BUCKETS),
+        'blog_markdown_duration_seconds': ('Markdown render time per request', DURATION_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(dict)
+        self.cache = Counter()
+
+    def observe(self, view, duration, metrics):
+        values = {
+            'blog_request_duration_seconds': duration,
+            'blog_db_queries': metrics.queries,
+            'blog_db_duration_seconds': metrics.timings['db'],
+            'blog_template_duration_seconds': metrics.timings['template'],
+            'blog_markdown_duration_seconds': metrics.timings['markdown'],
+        }
+        with self.lock:
+            for name, value in values.items():
+                per_view = self.histograms[name]
+                if view not in per_view:
+                    per_view[view] = Histogram(self.HISTOGRAMS[name][1])
+                per_view[view].observe(value)
+            for result, count in metrics.cache.items():
+                self.cache[view, result] += count
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help_text, _) in self.HISTOGRAMS.items():
+                lines += [f'# HELP {name} {help_text}.', f'# TYPE {name} histogram']
+                for view, histogram in sorted(self.histograms[name].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{view="{view}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+            name = 'blog_cache_requests_total'
+            lines += [f'# HELP {name} Cache lookups by result.', f'# TYPE {name} counter']
+            for (view, result), count in sorted(self.cache.items()):
+                lines.append(f'{name}{{view="{view}",result="{result}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def server_timing(metrics, duration):
+    parts = [f'db;dur={metrics.timings["db"] * 1000:.1f};desc="{metrics.queries} queries"']
+    for name in ('template', 'markdown'):
+        if name in metrics.timings:
+            parts.append(f'{name};dur={metrics.timings[name] * 1000:.1f};desc="{TIMINGS[name]}"')
+    if metrics.cache:
+        parts.append('cache;desc="{}"'.format(
+            ', '.join(f'{count} {result}' for result, count in sorted(metrics.cache.items()))
+        ))
+    parts.append(f'total;dur={duration * 1000:.1f}')
+    return ', '.join(parts)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'BLOG_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_hook, dispatch_uid='blog.metrics')
+        for connection in connections.all(initialized_only=True):
+            install_query_hook(connection=connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - started)
+
+    def finish(self, request, response, metrics, duration):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        if view != 'metrics':
+            registry.observe(view, duration, metrics)
+        response.headers['Server-Timing'] = server_timing(metrics, duration)
+        return response
+
+
+def scrape_allowed(request):
+    # Not by address: behind a local reverse proxy every request is local
+    token = getattr(settings, 'BLOG_METRICS_TOKEN', '')
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(credentials, token):
+            return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, for staff or with the BLOG_METRICS_TOKEN bearer token."""
+    if not getattr(settings, 'BLOG_METRICS', False) or not scrape_allowed(request):
+        raise Http404
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
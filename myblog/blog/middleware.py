@@ -0,0 +1,202 @@
+import json
+import mimetypes
+import os
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .routers import _read_alias, choose_replica
+from .staticfiles import ENCODINGS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'blog_primary'
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Unhashed names can change under the same URL on the next deploy
+MUTABLE_CACHE_CONTROL = 'public, max-age=60'
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        stat = os.stat(path)
+        content_type, _ = mimetypes.guess_type(path)
+        self.content_type = content_type or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type in (
+            'application/javascript', 'application/json', 'image/svg+xml',
+        ):
+            self.content_type += '; charset=utf-8'
+        self.mtime = int(stat.st_mtime)
+        self.etag = f'"{self.mtime:x}-{stat.st_size:x}"'
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if immutable else MUTABLE_CACHE_CONTROL
+        # Content-Encoding -> path, in order of preference; None is identity
+        self.variants = {
+            encoding: path + suffix
+            for encoding, suffix in ENCODINGS.items()
+            if os.path.exists(path + suffix)
+        }
+        self.variants[None] = path
+
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows (q > 0)."""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        params = params.strip()
+        try:
+            q = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            q = 0.0
+        if coding and q > 0:
+            accepted.add(coding)
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """
+    Serve collected static files from STATIC_ROOT.
+
+    Files are indexed once at startup. Hashed names from the manifest get
+    far-future immutable caching, and the precompressed `.br` / `.gz` copies
+    written by CompressedManifestStaticFilesStorage are chosen by
+    Accept-Encoding.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        # runserver serves static files itself in development
+        root = settings.STATIC_ROOT
+        if settings.DEBUG or not root or not os.path.isdir(root):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = urlsplit(settings.STATIC_URL).path
+        if not self.prefix.startswith('/'):
+            self.prefix = '/' + self.prefix
+        self.files = self.scan(os.fspath(root))
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def scan(self, root):
+        immutable = set()
+        manifest = os.path.join(root, getattr(staticfiles_storage, 'manifest_name', ''))
+        if os.path.isfile(manifest):
+            with open(manifest, encoding='utf-8') as f:
+                immutable = set(json.load(f).get('paths', {}).values())
+
+        suffixes = tuple(ENCODINGS.values())
+        files = {}
+        for directory, _, names in os.walk(root):
+            for filename in names:
+                if filename.endswith(suffixes):
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                files[self.prefix + name] = StaticFile(path, name in immutable)
+        return files
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        static_file = self.match(request)
+        if static_file is None:
+            return self.get_response(request)
+        return self.serve(request, static_file)
+
+    async def __acall__(self, request):
+        # Serving needs no database and no thread; only other paths go on
+        static_file = self.match(request)
+        if static_file is None:
+            return await self.get_response(request)
+        return self.serve(request, static_file)
+
+    def match(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        return self.files.get(request.path_info)
+
+    def serve(self, request, static_file):
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        encoding = next(
+            coding for coding in static_file.variants
+            if coding is None or coding in accepted or '*' in accepted
+        )
+        etag = static_file.etag if encoding is None else static_file.etag[:-1] + f'-{encoding}"'
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=static_file.mtime
+        )
+        if response is None:
+            response = FileResponse(
+                open(static_file.variants[encoding], 'rb'),
+                content_type=static_file.content_type,
+            )
+            del response.headers['Content-Disposition']
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(static_file.mtime)
+        response.headers['Cache-Control'] = static_file.cache_control
+        if len(static_file.variants) > 1:
+            response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """
+    Let safe requests read from a replica, except shortly after a write.
+
+    A successful POST (or other unsafe method) sets a signed cookie that
+    keeps the browser on the primary for BLOG_REPLICA_PIN_SECONDS, so users
+    see their own posts, comments and edits despite replication lag.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.BLOG_DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = settings.BLOG_REPLICA_PIN_SECONDS
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _read_alias.set(self.read_alias(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = _read_alias.set(self.read_alias(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.pin(request, response)
+
+    def read_alias(self, request):
+        if request.method not in SAFE_METHODS:
+            return None
+        if request.get_signed_cookie(PIN_COOKIE, None, salt=PIN_COOKIE, max_age=self.pin_seconds):
+            return None
+        return choose_replica()
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_signed_cookie(
+                PIN_COOKIE, '1', salt=PIN_COOKIE, max_age=self.pin_seconds,
+                httponly=True, samesite='Lax',
+            )
+        return response
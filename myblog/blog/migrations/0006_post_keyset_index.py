@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_post_content_html'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='post',
+            options={'ordering': ['-created', '-id']},
+        ),
+        migrations.RemoveIndex(
+            model_name='post',
+            name='blog_post_created_76eb4c_idx',
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created', '-id'], name='blog_post_created_9d5e6e_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_tagstat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Backs the case-insensitive email__iexact uniqueness checks in the
+        # registration and account forms.
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS blog_auth_user_email_upper_idx '
+            'ON auth_user (UPPER(email));',
+            'DROP INDEX IF EXISTS blog_auth_user_email_upper_idx;',
+        ),
+    ]
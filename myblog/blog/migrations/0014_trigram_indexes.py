@@ -0,0 +1,26 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_relatedpost'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # Back the ILIKE lookups of the suggest view. taggit_tag is not ours
+        # to declare indexes on, so both live here rather than in Meta.
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS blog_post_title_trgm_idx '
+            'ON blog_post USING gin (title gin_trgm_ops);',
+            'DROP INDEX IF EXISTS blog_post_title_trgm_idx;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS blog_taggit_tag_name_trgm_idx '
+            'ON taggit_tag USING gin (name gin_trgm_ops);',
+            'DROP INDEX IF EXISTS blog_taggit_tag_name_trgm_idx;',
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:37
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+
+def backfill_month_stats(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    MonthStat = apps.get_model('blog', 'MonthStat')
+    counts = (
+        Post.objects.filter(status='published').order_by()
+        .annotate(month=TruncMonth('created'))
+        .values('month').annotate(total=Count('pk')).values_list('month', 'total')
+    )
+    MonthStat.objects.bulk_create(
+        [MonthStat(month=month.date(), published_count=total) for month, total in counts]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_post_author_status_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthStat',
+            fields=[
+                ('month', models.DateField(primary_key=True, serialize=False)),
+                ('published_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.RunPython(backfill_month_stats, migrations.RunPython.noop),
+    ]
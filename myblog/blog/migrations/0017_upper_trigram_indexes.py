@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0016_monthstat'),
+    ]
+
+    operations = [
+        # The suggest view's istartswith/icontains lookups compile to
+        # UPPER("column"::text) LIKE UPPER(...), so the trigram indexes of
+        # 0014 on the bare columns were never used. Replace them with ones
+        # on that same expression.
+        migrations.RunSQL(
+            'DROP INDEX IF EXISTS blog_post_title_trgm_idx;',
+            'CREATE INDEX IF NOT EXISTS blog_post_title_trgm_idx '
+            'ON blog_post USING gin (title gin_trgm_ops);',
+        ),
+        migrations.RunSQL(
+            'DROP INDEX IF EXISTS blog_taggit_tag_name_trgm_idx;',
+            'CREATE INDEX IF NOT EXISTS blog_taggit_tag_name_trgm_idx '
+            'ON taggit_tag USING gin (name gin_trgm_ops);',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS blog_post_upper_title_trgm_idx '
+            'ON blog_post USING gin ((UPPER(title::text)) gin_trgm_ops);',
+            'DROP INDEX IF EXISTS blog_post_upper_title_trgm_idx;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS blog_taggit_tag_upper_name_trgm_idx '
+            'ON taggit_tag USING gin ((UPPER(name::text)) gin_trgm_ops);',
+            'DROP INDEX IF EXISTS blog_taggit_tag_upper_name_trgm_idx;',
+        ),
+    ]
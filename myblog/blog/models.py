@@ -1,11 +1,26 @@
+from collections import defaultdict
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest, TruncMonth
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import slugify
 from django.conf import settings
 from taggit.managers import TaggableManager
+from taggit.models import Tag
+from .cache import bump
+from .rendering import content_hash, render_markdown, renderer_version
+from .thumbnails import schedule_thumbnails
 
 # Create your models here.
 
+# Text search configuration shared by the stored vector and search queries
+SEARCH_CONFIG = 'english'
+
 class PublishedManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset().filter(status='published')
@@ -25,6 +40,23 @@ class Post(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='draft')
     tags = TaggableManager()
 
+    # Pre-rendered Markdown, refreshed on save and by `rerender_posts`
+    content_html = models.TextField(blank=True, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    renderer_version = models.CharField(max_length=16, blank=True, editable=False)
+
+    # Denormalized, kept in sync by the Comment signals and admin actions
+    approved_comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Maintained by Postgres on every write, title weighted above content
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('title', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('content', weight='B', config=SEARCH_CONFIG)
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     # Default manager (returns all posts)
     objects = models.Manager()
@@ -33,11 +65,14 @@ class Post(models.Model):
     published = PublishedManager()
 
     class Meta:
-        ordering = ['-created']
+        ordering = ['-created', '-id']
         indexes = [
-            models.Index(fields=['-created']),
+            models.Index(fields=['-created', '-id']),
+            # An author's posts of one status, in dashboard order
+            models.Index(fields=['author', 'status', '-created', '-id']),
             models.Index(fields=['status']),
             models.Index(fields=['slug']),
+            GinIndex(fields=['search_vector']),
         ]
 
     def __str__(self):
@@ -46,6 +81,39 @@ class Post(models.Model):
     def get_absolute_url(self):
         return reverse('blog:post_detail', kwargs={'slug': self.slug})
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember stored values so publishing and renames can be detected
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_title = instance.__dict__.get('title')
+        instance._loaded_slug = instance.__dict__.get('slug')
+        return instance
+
+    def needs_render(self):
+        return (
+            self.renderer_version != renderer_version()
+            or self.content_hash != content_hash(self.content)
+        )
+
+    def render_content(self, force=False):
+        """Refresh content_html; returns True if it was re-rendered."""
+        if not force and not self.needs_render():
+            return False
+        self.content_html = render_markdown(self.content)
+        self.content_hash = content_hash(self.content)
+        self.renderer_version = renderer_version()
+        return True
+
+    def save(self, *args, **kwargs):
+        rendered = self.render_content()
+        update_fields = kwargs.get('update_fields')
+        if rendered and update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                'content_html', 'content_hash', 'renderer_version',
+            }
+        super().save(*args, **kwargs)
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
@@ -61,6 +129,7 @@ class Comment(models.Model):
         indexes = [
             models.Index(fields=['created']),
             models.Index(fields=['approved']),
+            models.Index(fields=['post', 'approved', 'created']),
         ]
 
     def __str__(self):
@@ -70,6 +139,189 @@ class Comment(models.Model):
         return reverse('blog:post_detail', kwargs={'slug': self.post.slug})
 
 
+class RelatedPost(models.Model):
+    """One of a post's nearest published neighbours by shared tags, see blog.related."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_links')
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['post', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'rank'], name='blog_relatedpost_post_rank'),
+        ]
+
+
+class QueuedComment(models.Model):
+    """A comment waiting to be flushed; the database-backed comment queue."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    content = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['pk']
+
+
+def refresh_approved_comment_counts(post_ids):
+    """Recount approved comments for the given posts in a single UPDATE."""
+    approved = Comment.objects.filter(
+        post=OuterRef('pk'), approved=True
+    ).order_by().values('post').annotate(total=Count('pk')).values('total')
+    Post.objects.filter(pk__in=post_ids).update(
+        approved_comment_count=Coalesce(Subquery(approved), 0)
+    )
+
+
+def allocate_slugs(titles, exclude_pk=None):
+    """
+    Return a unique slug for each title, in order.
+
+    Existing `base`, `base-1`, `base-2`... slugs for the whole batch are
+    fetched in one query and collisions, including those within the batch,
+    are resolved in memory the same way the form always did.
+    """
+    max_length = Post._meta.get_field('slug').max_length
+    # Leave room for a numeric suffix
+    bases = [(slugify(title) or 'post')[:max_length - 8] for title in titles]
+    if not bases:
+        return []
+
+    # Prefix matches can use the slug index; extra rows such as `base-draft`
+    # only mark slugs taken that are taken anyway
+    query = Q(slug__in=set(bases))
+    for base in set(bases):
+        query |= Q(slug__startswith=f'{base}-')
+    taken = set(
+        Post.objects.filter(query)
+        .exclude(pk=exclude_pk)
+        .values_list('slug', flat=True)
+    )
+
+    slugs = []
+    for base in bases:
+        slug = base
+        counter = 1
+        while slug in taken:
+            slug = f'{base}-{counter}'
+            counter += 1
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+class TagStat(models.Model):
+    """Number of published posts per tag, maintained incrementally."""
+    tag = models.OneToOneField(
+        Tag,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stat'
+    )
+    published_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-published_count']),
+        ]
+
+    def __str__(self):
+        return f'{self.tag} ({self.published_count})'
+
+
+def adjust_tag_stats(deltas):
+    """Apply {tag_id: delta} to the published counts."""
+    deltas = {tag_id: delta for tag_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    TagStat.objects.bulk_create(
+        [TagStat(tag_id=tag_id) for tag_id in deltas],
+        ignore_conflicts=True,
+    )
+    by_delta = defaultdict(list)
+    for tag_id, delta in deltas.items():
+        by_delta[delta].append(tag_id)
+    for delta, tag_ids in by_delta.items():
+        TagStat.objects.filter(tag_id__in=tag_ids).update(
+            published_count=Greatest(F('published_count') + delta, 0)
+        )
+    # Every list page, tag pages included, shows the tag cloud
+    bump('lists')
+
+
+def refresh_tag_stats():
+    """Recount every tag from scratch."""
+    counts = dict(
+        Post.tags.through.objects.filter(
+            content_type__app_label='blog',
+            content_type__model='post',
+            object_id__in=Post.published.values('pk'),
+        ).order_by().values('tag').annotate(total=Count('pk')).values_list('tag', 'total')
+    )
+    TagStat.objects.exclude(tag_id__in=counts).delete()
+    TagStat.objects.bulk_create(
+        [TagStat(tag_id=tag_id, published_count=total) for tag_id, total in counts.items()],
+        update_conflicts=True,
+        unique_fields=['tag'],
+        update_fields=['published_count'],
+    )
+
+
+class MonthStat(models.Model):
+    """Number of published posts per month of creation, maintained incrementally."""
+    month = models.DateField(primary_key=True)
+    published_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-month']
+
+    def __str__(self):
+        return f'{self.month:%B %Y} ({self.published_count})'
+
+
+def month_of(created):
+    """The MonthStat bucket of a creation time, in the current time zone."""
+    return timezone.localtime(created).date().replace(day=1)
+
+
+def adjust_month_stats(deltas):
+    """Apply {month: delta} to the published counts."""
+    deltas = {month: delta for month, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    MonthStat.objects.bulk_create(
+        [MonthStat(month=month) for month in deltas],
+        ignore_conflicts=True,
+    )
+    by_delta = defaultdict(list)
+    for month, delta in deltas.items():
+        by_delta[delta].append(month)
+    for delta, months in by_delta.items():
+        MonthStat.objects.filter(month__in=months).update(
+            published_count=Greatest(F('published_count') + delta, 0)
+        )
+    # Every list page, tag pages included, shows the archive sidebar
+    bump('lists')
+
+
+def refresh_month_stats():
+    """Recount every month from scratch."""
+    counts = dict(
+        Post.published.order_by()
+        .annotate(month=TruncMonth('created'))
+        .values('month').annotate(total=Count('pk')).values_list('month', 'total')
+    )
+    counts = {month.date(): total for month, total in counts.items()}
+    MonthStat.objects.exclude(month__in=counts).delete()
+    MonthStat.objects.bulk_create(
+        [MonthStat(month=month, published_count=total) for month, total in counts.items()],
+        update_conflicts=True,
+        unique_fields=['month'],
+        update_fields=['published_count'],
+    )
+
+
 class Profile(models.Model):
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL,
@@ -80,6 +332,35 @@ class Profile(models.Model):
         upload_to='users/%Y/%m/%d/',
         blank=True
     )
-    
+    # {size: {format: name}} of the resized copies, see blog.thumbnails
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored photo so a new upload can be detected
+        instance._loaded_photo = instance.__dict__.get('photo')
+        return instance
+
     def __str__(self):
         return f'Profile of {self.user.username}'
+
+    def photo_url(self, size='medium', fmt='jpeg'):
+        """URL of a resized photo, or of the original until it is built."""
+        name = self.thumbnails.get(size, {}).get(fmt)
+        if name:
+            return self.photo.storage.url(name)
+        return self.photo.url if self.photo else ''
+
+    def save(self, *args, **kwargs):
+        photo_changed = self.photo.name != getattr(self, '_loaded_photo', '')
+        if photo_changed:
+            # The old variants belong to the old photo
+            stale, self.thumbnails = self.thumbnails, {}
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'thumbnails'}
+        super().save(*args, **kwargs)
+        if photo_changed:
+            self._loaded_photo = self.photo.name
+            schedule_thumbnails(self, stale)
@@ -0,0 +1,170 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset paginator over an ordering such as ('-created', '-id').
+
+    Pages are addressed by opaque cursors that encode the boundary row, so
+    fetching a page is an index range scan of `per_page + 1` rows: there is
+    no OFFSET and no COUNT(*), and deep pages cost the same as the first.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-created', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in ordering]
+        # All columns run the same way so one composite index serves the seek.
+        self.descending = ordering[0].startswith('-')
+
+    def page(self, cursor=None):
+        """Return the page for `cursor`; a missing or bad cursor gives page one."""
+        queryset, backwards, position = self._window(cursor)
+        return self._build_page(list(queryset), backwards, position)
+
+    async def apage(self, cursor=None):
+        """page() for async views, fetching rows with the async ORM."""
+        queryset, backwards, position = self._window(cursor)
+        return self._build_page(
+            [obj async for obj in queryset], backwards, position
+        )
+
+    def _window(self, cursor):
+        try:
+            direction, position = self.decode_cursor(cursor) if cursor else ('n', None)
+        except InvalidCursor:
+            direction, position = 'n', None
+
+        backwards = direction == 'p'
+        descending = self.descending != backwards
+        queryset = self.queryset.order_by(
+            *[f'-{name}' if descending else name for name in self.fields]
+        )
+        if position is not None:
+            queryset = queryset.filter(self._seek(position, backwards))
+        return queryset[:self.per_page + 1], backwards, position
+
+    def _build_page(self, rows, backwards, position):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        if not rows:
+            return CursorPage(rows)
+
+        if backwards:
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        return CursorPage(
+            rows,
+            next_cursor=self.encode_cursor('n', rows[-1]) if has_next else None,
+            previous_cursor=self.encode_cursor('p', rows[0]) if has_previous else None,
+        )
+
+    def _seek(self, position, backwards):
+        # (a, b) < (x, y) expanded as a <= x AND (a < x OR (a = x AND b < y)),
+        # keeping a plain range predicate on the leading index column.
+        op = 'lt' if self.descending != backwards else 'gt'
+        first = self.fields[0]
+        condition = Q()
+        for i in reversed(range(len(self.fields))):
+            name = self.fields[i]
+            step = Q(**{f'{name}__{op}': position[i]})
+            if i < len(self.fields) - 1:
+                step |= Q(**{name: position[i]}) & condition
+            condition = step
+        return Q(**{f'{first}__{op}e': position[0]}) & condition
+
+    def encode_cursor(self, direction, obj):
+        position = [str(getattr(obj, name)) for name in self.fields]
+        payload = json.dumps([direction, position], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, position = json.loads(base64.urlsafe_b64decode(padded))
+            if direction not in ('n', 'p') or len(position) != len(self.fields):
+                raise ValueError
+            model = self.queryset.model
+            position = [
+                model._meta.get_field(name).to_python(value)
+                for name, value in zip(self.fields, position)
+            ]
+        except (TypeError, ValueError, ValidationError) as exc:
+            raise InvalidCursor(cursor) from exc
+        return direction, position
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes large counts from the planner instead of COUNT(*).
+
+    Unfiltered querysets use the table's row estimate from pg_class and
+    filtered ones the row estimate of their plan. Exact counts are only
+    run when the estimate is small enough for them to be cheap.
+    """
+    exact_below = 10_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        estimate = self.estimate(queryset.order_by())
+        if estimate < self.exact_below:
+            return queryset.count()
+        return estimate
+
+    @staticmethod
+    def estimate(queryset):
+        if not queryset.query.where:
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # -1 until the table is first analyzed
+            if row and row[0] >= 0:
+                return row[0]
+            return 0
+        plan = json.loads(queryset.explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,107 @@
+"""
+Precomputed related posts.
+
+Each published post keeps its RELATED_POSTS nearest published neighbours
+in the RelatedPost table, so post_detail reads them with one indexed
+query. Two posts score the sum of the weights of the tags they share;
+a tag weighs less the more posts use it, and ties go to the newer post.
+
+The lists are refreshed after commit for the posts a publish, unpublish
+or retag affects (see blog.signals); rebuild_related_posts recomputes
+every list, e.g. after tag counts have drifted.
+"""
+import math
+
+from django.db import transaction
+from django.db.models import F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Ln
+
+from .cache import bump
+from .models import Post, RelatedPost
+
+RELATED_POSTS = 5
+
+
+def neighbours(post_id, limit=RELATED_POSTS):
+    """[(related post id, score)] for a post, best first."""
+    tag_ids = Post.tags.through.objects.filter(
+        content_type__app_label='blog',
+        content_type__model='post',
+        object_id=post_id,
+    ).values('tag_id')
+    return list(
+        Post.published.filter(tags__in=tag_ids)
+        .exclude(pk=post_id)
+        .annotate(score=Sum(
+            # Rarer tags say more: 1 / ln(e + posts using the tag)
+            Value(1.0) / Ln(
+                Cast(F('tags__stat__published_count'), FloatField()) + Value(math.e)
+            )
+        ))
+        .order_by('-score', '-created', '-id')
+        .values_list('pk', 'score')[:limit]
+    )
+
+
+def rebuild(post_ids):
+    """Recompute the lists of `post_ids`; drafts get an empty one."""
+    published = set(
+        Post.published.filter(pk__in=post_ids).values_list('pk', flat=True)
+    )
+    rows = []
+    keep = Q(pk__in=[])
+    # Sorted, so concurrent rebuilds lock the rows of shared posts in one order
+    for post_id in sorted(published):
+        found = neighbours(post_id)
+        rows += [
+            RelatedPost(post_id=post_id, related_id=related_id, rank=rank, score=score)
+            for rank, (related_id, score) in enumerate(found)
+        ]
+        keep |= Q(post_id=post_id, rank__lt=len(found))
+    # Rows are overwritten in place rather than deleted and inserted again,
+    # so a rebuild racing another one over the same posts cannot conflict.
+    with transaction.atomic():
+        RelatedPost.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['post', 'rank'],
+            update_fields=['related', 'score'],
+        )
+        RelatedPost.objects.filter(post_id__in=post_ids).exclude(keep).delete()
+
+
+def refresh(post_ids):
+    """
+    Refresh the lists a change to `post_ids` can affect: their own, the ones
+    they appear in, and those of their new neighbours (scores are symmetric,
+    so a post that gained a neighbour may have entered that neighbour's list).
+    """
+    affected = set(post_ids)
+    affected.update(
+        RelatedPost.objects.filter(related_id__in=post_ids).values_list('post_id', flat=True)
+    )
+    rebuild(post_ids)
+    affected.update(
+        RelatedPost.objects.filter(post_id__in=post_ids).values_list('related_id', flat=True)
+    )
+    rebuild(affected - set(post_ids))
+    slugs = Post.objects.filter(pk__in=affected).values_list('slug', flat=True)
+    bump(*[f'post:{slug}' for slug in slugs])
+
+
+def schedule_refresh(post_ids):
+    """
+    refresh() once the current transaction commits. The write that scheduled
+    it has committed by then, so a failure is logged instead of raised.
+    """
+    post_ids = set(post_ids)
+    transaction.on_commit(lambda: refresh(post_ids), robust=True)
+
+
+def related_posts_for(post):
+    """The stored neighbours of `post`, as RelatedPost rows with `related` loaded."""
+    return (
+        RelatedPost.objects.filter(post=post, related__status='published')
+        .select_related('related')
+        .only('rank', 'related', 'related__title', 'related__slug', 'related__created')
+    )
@@ -0,0 +1,30 @@
+import hashlib
+
+import markdown
+
+from .metrics import timed
+
+# Bump RENDERER_REVISION whenever the rendering output changes in a way the
+# extension list does not capture (e.g. new extension configs).
+RENDERER_REVISION = 1
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'codehilite', 'tables', 'nl2br']
+
+
+def renderer_version():
+    """Short fingerprint of everything that affects the rendered HTML."""
+    signature = '|'.join([
+        str(RENDERER_REVISION),
+        markdown.__version__,
+        ','.join(MARKDOWN_EXTENSIONS),
+    ])
+    return hashlib.sha256(signature.encode()).hexdigest()[:16]
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def render_markdown(text):
+    with timed('markdown'):
+        return markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS)
@@ -0,0 +1,41 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Replica alias reads of the current request may use; None reads the primary.
+# Set by ReplicaPinningMiddleware, so code outside a request (management
+# commands, workers) always reads what it writes.
+_read_alias = ContextVar('blog_read_alias', default=None)
+
+
+def choose_replica():
+    replicas = settings.BLOG_DATABASE_REPLICAS
+    return random.choice(replicas) if replicas else None
+
+
+class ReplicaRouter:
+    """Send reads to a replica when the request allows it, writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        # Inside a transaction, read from where the transaction writes
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *settings.BLOG_DATABASE_REPLICAS}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        if db in settings.BLOG_DATABASE_REPLICAS:
+            return False
+        return None
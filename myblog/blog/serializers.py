@@ -0,0 +1,71 @@
+from rest_framework import serializers
+from taggit.models import Tag
+from .models import Comment, Post
+
+
+class SparseFieldsMixin:
+    """
+    Limit the serialized fields to those named in `?fields=a,b,c`.
+
+    Unknown names are ignored; without the parameter every field is returned.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields(self.context.get('request'))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @staticmethod
+    def requested_fields(request):
+        if request is None or not request.query_params.get('fields'):
+            return None
+        return {
+            name.strip()
+            for name in request.query_params['fields'].split(',')
+            if name.strip()
+        }
+
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    author = serializers.CharField(source='author.username', read_only=True)
+    tags = serializers.SerializerMethodField()
+    comment_count = serializers.IntegerField(
+        source='approved_comment_count', read_only=True
+    )
+    url = serializers.CharField(source='get_absolute_url', read_only=True)
+
+    class Meta:
+        model = Post
+        fields = [
+            'id', 'title', 'slug', 'author', 'created', 'updated',
+            'tags', 'comment_count', 'url',
+        ]
+        read_only_fields = fields
+
+    def get_tags(self, obj):
+        # Served from the prefetch cache set up by the view
+        return [tag.name for tag in obj.tags.all()]
+
+
+class PostDetailSerializer(PostSerializer):
+    class Meta(PostSerializer.Meta):
+        fields = PostSerializer.Meta.fields + ['content', 'content_html']
+        read_only_fields = fields
+
+
+class TagSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = ['id', 'name', 'slug']
+        read_only_fields = fields
+
+
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    author = serializers.CharField(source='author.username', read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'author', 'content', 'created', 'updated']
+        read_only_fields = fields
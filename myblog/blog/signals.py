@@ -1,7 +1,20 @@
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import Profile
+from taggit.models import Tag
+from .cache import bump, forget_tag
+from .models import (
+    Comment,
+    Post,
+    Profile,
+    RelatedPost,
+    adjust_month_stats,
+    adjust_tag_stats,
+    month_of,
+    refresh_approved_comment_counts,
+)
+from .related import schedule_refresh
 
 User = get_user_model()
 
@@ -11,10 +24,117 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    """Save the Profile whenever the User is saved"""
-    try:
-        instance.profile.save()
-    except Profile.DoesNotExist:
-        Profile.objects.create(user=instance)
+def post_namespaces(post, tag_slugs=None):
+    """Cache namespaces whose pages show `post`"""
+    if tag_slugs is None:
+        tag_slugs = post.tags.slugs()
+    return (
+        ['list', f'post:{post.slug}', f'author:{post.author_id}']
+        + [f'tag:{slug}' for slug in tag_slugs]
+    )
+
+
+def changed(post, field):
+    """True if `field` differs from the value loaded from the database"""
+    loaded = getattr(post, f'_loaded_{field}', None)
+    return loaded is not None and loaded != getattr(post, field)
+
+
+@receiver(post_save, sender=Post)
+def invalidate_saved_post(sender, instance, **kwargs):
+    bump(*post_namespaces(instance))
+
+    was_published = getattr(instance, '_loaded_status', None) == 'published'
+    is_published = instance.status == 'published'
+    if was_published != is_published:
+        delta = 1 if is_published else -1
+        adjust_tag_stats({
+            tag_id: delta
+            for tag_id in instance.tags.values_list('pk', flat=True)
+        })
+        adjust_month_stats({month_of(instance.created): delta})
+        schedule_refresh([instance.pk])
+    elif is_published and (changed(instance, 'title') or changed(instance, 'slug')):
+        # Related lists elsewhere show this post's title and URL, and the
+        # page at the old URL must stop being served
+        slugs = RelatedPost.objects.filter(related=instance).values_list(
+            'post__slug', flat=True
+        )
+        old_slug = instance._loaded_slug or instance.slug
+        bump(f'post:{old_slug}', *[f'post:{slug}' for slug in slugs])
+    instance._loaded_status = instance.status
+    instance._loaded_title = instance.title
+    instance._loaded_slug = instance.slug
+
+
+@receiver(pre_delete, sender=Post)
+def invalidate_deleted_post(sender, instance, **kwargs):
+    # Tags are read before the delete cascades to the tagged items.
+    bump(*post_namespaces(instance))
+    if instance.status == 'published':
+        adjust_tag_stats({
+            tag_id: -1
+            for tag_id in instance.tags.values_list('pk', flat=True)
+        })
+        adjust_month_stats({month_of(instance.created): -1})
+    # The lists showing this post lose it; their rows go with the cascade.
+    schedule_refresh(
+        RelatedPost.objects.filter(related=instance).values_list('post_id', flat=True)
+    )
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_retagged_post(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Post):
+        return
+    published = instance.status == 'published'
+    if action in ('post_add', 'post_remove') and pk_set:
+        tag_slugs = Tag.objects.filter(pk__in=pk_set).values_list('slug', flat=True)
+        bump(*post_namespaces(instance, tag_slugs))
+        if published:
+            delta = 1 if action == 'post_add' else -1
+            adjust_tag_stats({tag_id: delta for tag_id in pk_set})
+            schedule_refresh([instance.pk])
+    elif action == 'pre_clear':
+        bump(*post_namespaces(instance))
+        if published:
+            adjust_tag_stats({
+                tag_id: -1
+                for tag_id in instance.tags.values_list('pk', flat=True)
+            })
+            schedule_refresh([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tag(sender, instance, **kwargs):
+    bump('lists', f'tag:{instance.slug}')
+    forget_tag(instance.slug)
+
+
+def deleted_with_post(origin):
+    """True when a delete cascaded from a Post, which is invalidated itself"""
+    return isinstance(origin, Post) or getattr(origin, 'model', None) is Post
+
+
+@receiver(post_save, sender=Comment)
+def invalidate_commented_post(sender, instance, created, **kwargs):
+    if created:
+        if instance.approved:
+            Post.objects.filter(pk=instance.post_id).update(
+                approved_comment_count=F('approved_comment_count') + 1
+            )
+    else:
+        # The approval may have flipped either way; recount this post.
+        refresh_approved_comment_counts([instance.post_id])
+    bump(f'post:{instance.post.slug}', f'author:{instance.post.author_id}')
+
+
+@receiver(post_delete, sender=Comment)
+def invalidate_uncommented_post(sender, instance, origin=None, **kwargs):
+    if deleted_with_post(origin):
+        return
+    if instance.approved:
+        Post.objects.filter(pk=instance.post_id).update(
+            approved_comment_count=F('approved_comment_count') - 1
+        )
+    bump(f'post:{instance.post.slug}', f'author:{instance.post.author_id}')
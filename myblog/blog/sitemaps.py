@@ -0,0 +1,26 @@
+from django.contrib.sitemaps import Sitemap
+from django.db.models import Max
+
+from .models import Post
+
+
+class PostSitemap(Sitemap):
+    # URLs per sitemap file; the index links one file per chunk
+    limit = 5000
+    changefreq = 'weekly'
+
+    def items(self):
+        # Primary key order keeps chunk boundaries stable as posts are added
+        return Post.published.only('slug', 'updated').order_by('pk')
+
+    def lastmod(self, obj):
+        return obj.updated
+
+    def get_latest_lastmod(self):
+        # The default calls lastmod() on every post; ask the database instead
+        return Post.published.aggregate(latest=Max('updated'))['latest']
+
+
+SITEMAPS = {
+    'posts': PostSitemap,
+}
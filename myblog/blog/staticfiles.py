@@ -0,0 +1,58 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip variants are always written
+    brotli = None
+
+# Only text formats are worth compressing; images and fonts already are.
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml',
+}
+# Below this size the Content-Encoding header costs more than it saves
+MIN_COMPRESS_SIZE = 256
+
+ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, mode=brotli.MODE_TEXT)
+    # mtime=0 keeps the output identical across collectstatic runs
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also writes `.gz` and `.br` copies next to each
+    collected text file, so they can be served without compressing per request.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in set(paths) | set(self.hashed_files.values()):
+            if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+                self.write_compressed(name)
+
+    def write_compressed(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        for encoding, suffix in ENCODINGS.items():
+            if encoding == 'br' and brotli is None:
+                continue
+            compressed = compress(data, encoding)
+            # Keep the variant only if it is meaningfully smaller
+            if len(compressed) < len(data) * 0.95:
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
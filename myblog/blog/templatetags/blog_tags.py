@@ -0,0 +1,39 @@
+from django import template
+from ..cache import cached_value
+from ..models import MonthStat, TagStat
+from ..thumbnails import THUMBNAIL_SIZES
+
+register = template.Library()
+
+
+@register.inclusion_tag('blog/tag_cloud.html')
+def tag_cloud(limit=30):
+    """Most used tags, read from the maintained TagStat counts."""
+    # Every change to a count bumps the generation of all list pages.
+    def compute():
+        return list(
+            TagStat.objects.filter(published_count__gt=0)
+            .select_related('tag')
+            .order_by('-published_count')[:limit]
+        )
+    return {'stats': cached_value(f'tag-cloud:{limit}', ['lists'], compute)}
+
+
+@register.inclusion_tag('blog/archive.html')
+def archive():
+    """Months with published posts, newest first, from the MonthStat counts."""
+    def compute():
+        return list(MonthStat.objects.filter(published_count__gt=0))
+    return {'stats': cached_value('archive', ['lists'], compute)}
+
+
+@register.inclusion_tag('blog/avatar.html')
+def avatar(profile, size='medium'):
+    """A resized profile photo, as WebP where the browser accepts it."""
+    built = profile.thumbnails.get(size, {})
+    return {
+        'profile': profile,
+        'edge': THUMBNAIL_SIZES[size],
+        'webp': profile.photo_url(size, 'webp') if 'webp' in built else '',
+        'src': profile.photo_url(size),
+    }
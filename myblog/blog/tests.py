@@ -1,3 +1,1559 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+from io import BytesIO, StringIO
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.http import Http404, HttpResponse
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings,
+)
+from django.templatetags.static import static
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import async_views, metrics
+from .cache import GENERATION_TIMEOUT, bump
+from .comment_queue import SpoolQueue, flush, get_queue
+from .middleware import ReplicaPinningMiddleware, StaticFilesMiddleware
+from .models import (
+    Comment, MonthStat, Post, Profile, QueuedComment, RelatedPost, TagStat,
+    allocate_slugs, month_of, refresh_month_stats,
+)
+from .pagination import CursorPaginator
+from .rendering import content_hash, renderer_version
+from .related import rebuild, related_posts_for
+from .routers import ReplicaRouter
+from .thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_SIZES, build_thumbnails
+
+User = get_user_model()
+
+
+class PostListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_posts(self, count, tags=('django', 'python')):
+        start = Post.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(start, start + count):
+                post = Post.objects.create(
+                    title=f'Post {i}',
+                    slug=f'post-{i}',
+                    author=self.author,
+                    content='Some *content*',
+                    status='published',
+                )
+                post.tags.add(*tags)
+
+    def test_post_list_query_count_is_constant(self):
+        self.create_posts(1)
+        # The page of posts with their authors, the tags, the tag cloud and
+        # the archive.
+        with self.assertNumQueries(4):
+            self.client.get(reverse('blog:post_list'))
+
+        self.create_posts(5)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('blog:post_list'))
+        self.assertContains(response, 'author')
+
+    def test_tag_list_query_count_is_constant(self):
+        self.create_posts(6)
+        url = reverse('blog:post_list_by_tag', args=['django'])
+        # The tag lookup plus the four list queries.
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertContains(response, 'Posts tagged with "django"')
+
+    def test_draft_count_comes_from_the_cached_author_stats(self):
+        self.create_posts(3)
+        Post.objects.create(
+            title='Draft', slug='draft', author=self.author, content='wip'
+        )
+        self.client.force_login(self.author)
+        # Session and user lookups, the four list queries and the stats.
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('blog:post_list'))
+        self.assertContains(response, '1 draft</a>')
+        # The stats, the tag cloud and the archive now come from the cache.
+        with self.assertNumQueries(4):
+            self.client.get(reverse('blog:post_list'))
+
+
+class CursorPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', 'author@example.com', 'pass')
+        Post.objects.bulk_create([
+            Post(title=f'Post {i}', slug=f'post-{i}', author=author,
+                 content='', status='published')
+            for i in range(7)
+        ])
+        # Same timestamp everywhere so ordering falls back to the id.
+        Post.objects.update(created=Post.objects.first().created)
+
+    def test_walks_forward_and_back(self):
+        paginator = CursorPaginator(Post.published.all(), 3)
+        expected = list(Post.published.values_list('pk', flat=True))
+
+        first = paginator.page()
+        self.assertFalse(first.has_previous())
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        self.assertFalse(third.has_next())
+        seen = [post.pk for page in (first, second, third) for post in page]
+        self.assertEqual(seen, expected)
+
+        back = paginator.page(third.previous_cursor)
+        self.assertEqual([post.pk for post in back], expected[3:6])
+        back = paginator.page(back.previous_cursor)
+        self.assertEqual([post.pk for post in back], expected[:3])
+        self.assertFalse(back.has_previous())
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        paginator = CursorPaginator(Post.published.all(), 3)
+        page = paginator.page('not-a-cursor')
+        self.assertEqual(len(page), 3)
+        self.assertFalse(page.has_previous())
+
+
+class RenderContentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        cls.post = Post.objects.create(
+            title='Rendered', slug='rendered', author=cls.author,
+            content='*Body*', status='published',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def rerender(self, *args):
+        out = StringIO()
+        call_command('rerender_posts', *args, stdout=out)
+        return out.getvalue()
+
+    def test_saving_stores_the_rendered_html(self):
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.content_html, '<p><em>Body</em></p>')
+        self.assertEqual(post.content_hash, content_hash('*Body*'))
+        self.assertEqual(post.renderer_version, renderer_version())
+
+    def test_rerender_writes_only_stale_rows(self):
+        Post.objects.create(title='Fresh', slug='fresh', author=self.author, content='Fresh')
+        Post.objects.filter(pk=self.post.pk).update(content='_Edited_')
+        self.assertIn('Re-rendered 1 post(s).', self.rerender())
+        self.assertEqual(
+            Post.objects.get(pk=self.post.pk).content_html, '<p><em>Edited</em></p>'
+        )
+        self.assertIn('Re-rendered 0 post(s).', self.rerender())
+        self.assertIn('Re-rendered 2 post(s).', self.rerender('--all'))
+
+    def test_rerender_invalidates_cached_pages(self):
+        url = self.post.get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        with mock.patch('blog.models.renderer_version', return_value='next'), \
+                mock.patch('blog.models.render_markdown', return_value='<p>Next</p>'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.rerender()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+            self.assertContains(self.client.get(url), '<p>Next</p>')
+            self.assertContains(self.client.get(reverse('blog:post_feed')), 'Next')
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        cls.post = Post.objects.create(
+            title='Cached', slug='cached', author=cls.author,
+            content='Body', status='published',
+        )
+        cls.post.tags.add('django')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        for url in (
+            reverse('blog:post_list'),
+            reverse('blog:post_list_by_tag', args=['django']),
+            self.post.get_absolute_url(),
+        ):
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                self.client.get(url)
+
+    def test_comment_invalidates_detail_page(self):
+        url = self.post.get_absolute_url()
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(
+                post=self.post, author=self.author,
+                content='First!', approved=True,
+            )
+        self.assertContains(self.client.get(url), 'First!')
+
+    def test_retagging_invalidates_tag_pages(self):
+        url = reverse('blog:post_list_by_tag', args=['django'])
+        self.assertContains(self.client.get(url), 'Cached')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.tags.remove('django')
+        self.assertNotContains(self.client.get(url), 'Cached')
+
+    def test_posts_bumped_together_keep_their_own_pages(self):
+        other = Post.objects.create(
+            title='Other', slug='other', author=self.author,
+            content='Body', status='published',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            bump('post:cached', 'post:other')
+        self.assertContains(self.client.get(self.post.get_absolute_url()), 'Cached')
+        self.assertContains(self.client.get(other.get_absolute_url()), 'Other')
+
+    def test_generations_created_by_reads_expire(self):
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            self.client.get(reverse('blog:post_detail', args=['no-such-post']))
+        self.assertEqual(set_many.call_args.args[1], GENERATION_TIMEOUT)
+
+    def test_authenticated_pages_are_not_cached(self):
+        self.client.force_login(self.author)
+        url = reverse('blog:post_list')
+        self.client.get(url)
+        # update() skips the invalidation signals.
+        Post.objects.filter(pk=self.post.pk).update(title='Renamed')
+        self.assertContains(self.client.get(url), 'Renamed')
+
+
+class CommentCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        cls.post = Post.objects.create(
+            title='Post', slug='post', author=cls.author,
+            content='Body', status='published',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def count(self):
+        self.post.refresh_from_db(fields=['approved_comment_count'])
+        return self.post.approved_comment_count
+
+    def test_count_follows_create_approve_and_delete(self):
+        pending = Comment.objects.create(
+            post=self.post, author=self.author, content='Pending'
+        )
+        approved = Comment.objects.create(
+            post=self.post, author=self.author, content='Ok', approved=True
+        )
+        self.assertEqual(self.count(), 1)
+
+        pending.approved = True
+        pending.save()
+        self.assertEqual(self.count(), 2)
+
+        approved.delete()
+        self.assertEqual(self.count(), 1)
+
+    def test_comments_are_paginated(self):
+        Comment.objects.bulk_create([
+            Comment(post=self.post, author=self.author,
+                    content=f'Comment {i}', approved=True)
+            for i in range(25)
+        ])
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertContains(response, 'Comment 19')
+        self.assertNotContains(response, 'Comment 20')
+        next_page = response.context['comments'].next_cursor
+        response = self.client.get(
+            self.post.get_absolute_url(), {'cursor': next_page}
+        )
+        self.assertContains(response, 'Comment 24')
+
+
+class PostApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        for i in range(5):
+            post = Post.objects.create(
+                title=f'Post {i}', slug=f'post-{i}', author=cls.author,
+                content='# Heading', status='published',
+            )
+            post.tags.add('django', f'tag-{i}')
+        Post.objects.create(
+            title='Draft', slug='draft', author=cls.author, content='wip'
+        )
+
+    def test_list_query_count_is_bounded(self):
+        # The page of posts with their authors, then the tags.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('blog:api-post-list'))
+        results = response.json()['results']
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0]['author'], 'author')
+        self.assertIn('django', results[0]['tags'])
+
+    def test_sparse_fieldsets_skip_unused_joins(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse('blog:api-post-list'), {'fields': 'title,slug'}
+            )
+        self.assertEqual(
+            set(response.json()['results'][0]), {'title', 'slug'}
+        )
+
+    def test_detail_returns_rendered_html(self):
+        response = self.client.get(
+            reverse('blog:api-post-detail', args=['post-0'])
+        )
+        self.assertIn('<h1>Heading</h1>', response.json()['content_html'])
+        response = self.client.get(
+            reverse('blog:api-post-detail', args=['draft'])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_comments_are_approved_only(self):
+        post = Post.objects.get(slug='post-0')
+        Comment.objects.create(
+            post=post, author=self.author, content='Visible', approved=True
+        )
+        Comment.objects.create(post=post, author=self.author, content='Hidden')
+        response = self.client.get(
+            reverse('blog:api-post-comments', args=['post-0'])
+        )
+        contents = [c['content'] for c in response.json()['results']]
+        self.assertEqual(contents, ['Visible'])
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        cls.post = Post.objects.create(
+            title='Post', slug='post', author=cls.author,
+            content='Body', status='published',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unchanged_pages_return_304_without_queries(self):
+        for url in (reverse('blog:post_list'), self.post.get_absolute_url()):
+            response = self.client.get(url)
+            self.assertTrue(response.has_header('Last-Modified'))
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag']
+                )
+            self.assertEqual(response.status_code, 304)
+
+    def test_write_changes_the_etag(self):
+        url = self.post.get_absolute_url()
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(
+                post=self.post, author=self.author, content='New', approved=True
+            )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_differs_per_viewer(self):
+        url = reverse('blog:post_list')
+        anonymous = self.client.get(url)['ETag']
+        self.client.force_login(self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous)
+        self.assertEqual(response.status_code, 200)
+
+
+class TagStatTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+
+    def counts(self):
+        return dict(
+            TagStat.objects.filter(published_count__gt=0)
+            .values_list('tag__name', 'published_count')
+        )
+
+    def test_counts_follow_publish_retag_and_delete(self):
+        post = Post.objects.create(
+            title='Post', slug='post', author=self.author, content=''
+        )
+        post.tags.add('django', 'python')
+        self.assertEqual(self.counts(), {})
+
+        post.status = 'published'
+        post.save()
+        self.assertEqual(self.counts(), {'django': 1, 'python': 1})
+
+        post.tags.set(['django', 'orm'])
+        self.assertEqual(self.counts(), {'django': 1, 'orm': 1})
+
+        post = Post.objects.get(pk=post.pk)
+        post.status = 'draft'
+        post.save()
+        self.assertEqual(self.counts(), {})
+
+        post.status = 'published'
+        post.save()
+        post.delete()
+        self.assertEqual(self.counts(), {})
+
+    def test_edit_form_saves_tags(self):
+        post = Post.objects.create(
+            title='Post', slug='post', author=self.author,
+            content='', status='published',
+        )
+        self.client.force_login(self.author)
+        self.client.post(reverse('blog:post_edit', args=['post']), {
+            'title': 'Post', 'content': 'Body',
+            'tags': 'django, python', 'status': 'published',
+        })
+        self.assertEqual(self.counts(), {'django': 1, 'python': 1})
+        self.assertEqual(sorted(post.tags.names()), ['django', 'python'])
+
+    def test_tag_pages_show_the_new_counts(self):
+        cache.clear()
+        for slug, tag in [('alpha', 'alpha'), ('zeta', 'zeta')]:
+            post = Post.objects.create(
+                title=slug, slug=slug, author=self.author, content='', status='published',
+            )
+            post.tags.add(tag)
+        url = reverse('blog:post_list_by_tag', args=['alpha'])
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title='Another', slug='another', author=self.author, content='',
+            )
+            post.tags.add('zeta')
+            post.status = 'published'
+            post.save()
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'zeta</a> (2)')
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        for i in range(4):
+            post = Post.objects.create(
+                title=f'Async post {i}', slug=f'async-post-{i}',
+                author=cls.author, content='# Async body', status='published',
+            )
+            post.tags.add('django')
+        Comment.objects.create(
+            post=post, author=cls.author, content='Async comment', approved=True
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, path, data=None):
+        request = AsyncRequestFactory().get(path, data)
+        request.user = AnonymousUser()
+
+        async def auser():
+            return request.user
+
+        request.auser = auser
+        return request
+
+    async def test_post_list(self):
+        response = await async_views.post_list(self.get('/blog/'))
+        self.assertContains(response, 'Async post 3')
+        self.assertNotContains(response, 'Async post 0')
+        response = await async_views.post_list(
+            self.get('/blog/tag/django/'), tag_slug='django'
+        )
+        self.assertContains(response, 'Posts tagged with')
+
+    async def test_post_detail(self):
+        response = await async_views.post_detail(
+            self.get('/blog/async-post-3/'), slug='async-post-3'
+        )
+        self.assertContains(response, '<h1>Async body</h1>')
+        self.assertContains(response, 'Async comment')
+        self.assertTrue(response.has_header('ETag'))
+
+    async def test_post_detail_records_markdown_time(self):
+        await Post.objects.filter(slug='async-post-0').aupdate(renderer_version='old')
+        request_metrics = metrics.RequestMetrics()
+        token = metrics._current.set(request_metrics)
+        try:
+            await async_views.post_detail(
+                self.get('/blog/async-post-0/'), slug='async-post-0'
+            )
+        finally:
+            metrics._current.reset(token)
+        self.assertGreater(request_metrics.timings['markdown'], 0)
+
+    async def test_post_search(self):
+        response = await async_views.post_search(
+            self.get('/blog/search/', {'query': 'async'})
+        )
+        self.assertContains(response, 'Async post 0')
+        self.assertContains(response, '<mark>')
+
+    async def test_post_search_escapes_the_content(self):
+        await Post.objects.acreate(
+            title='Markup', slug='markup', author=self.author, status='published',
+            content='<img src=x onerror=alert(1)> async <b',
+        )
+        response = await async_views.post_search(
+            self.get('/blog/search/', {'query': 'async'})
+        )
+        self.assertContains(response, '&lt;img src=x onerror=alert(1)&gt; <mark>async</mark>')
+        self.assertNotContains(response, '<img src=x')
+
+
+class AccountWriteTests(TestCase):
+    def test_registration_query_count(self):
+        data = {
+            'username': 'new', 'first_name': 'New', 'email': 'new@example.com',
+            'password': 'a-long-passphrase', 'password2': 'a-long-passphrase',
+        }
+        # Username and email checks, the user insert, the profile insert.
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('blog:register'), data)
+        self.assertTemplateUsed(response, 'blog/register_done.html')
+        self.assertTrue(User.objects.get(username='new').profile)
+
+    def test_email_check_is_case_insensitive(self):
+        User.objects.create_user('taken', 'Taken@Example.com', 'pass')
+        response = self.client.post(reverse('blog:register'), {
+            'username': 'other', 'email': 'taken@example.com',
+            'password': 'pass', 'password2': 'pass',
+        })
+        self.assertFormError(
+            response.context['user_form'], 'email', 'Email already in use.'
+        )
+
+    def test_login_does_not_write_the_profile(self):
+        user = User.objects.create_user('user', 'user@example.com', 'pass')
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+
+    def test_edit_writes_only_changed_columns(self):
+        user = User.objects.create_user('user', 'user@example.com', 'pass')
+        self.client.force_login(user)
+        data = {'first_name': '', 'last_name': '', 'email': 'user@example.com',
+                'date_of_birth': ''}
+        with self.assertNumQueries(3):
+            # Session, user and profile reads; nothing changed, no writes.
+            self.client.post(reverse('blog:edit'), data)
+        data['first_name'] = 'Renamed'
+        with self.assertNumQueries(4):
+            self.client.post(reverse('blog:edit'), data)
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, 'Renamed')
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.user = User.objects.create_user('user', 'user@example.com', 'pass')
+        self.client.force_login(self.user)
+
+    def upload(self, name='me.jpg'):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'teal').save(buffer, 'JPEG')
+        data = {'email': 'user@example.com', 'photo': SimpleUploadedFile(
+            name, buffer.getvalue(), content_type='image/jpeg'
+        )}
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('blog:edit'), data)
+        # The request only stores the upload and queues the resize.
+        self.assertEqual(len(callbacks), 1)
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(profile.thumbnails, {})
+        return profile
+
+    def test_variants_are_built_and_recorded(self):
+        profile = self.upload()
+        build_thumbnails(profile.pk, profile.photo.name)
+        profile.refresh_from_db()
+
+        self.assertEqual(set(profile.thumbnails), set(THUMBNAIL_SIZES))
+        for size, edge in THUMBNAIL_SIZES.items():
+            self.assertEqual(set(profile.thumbnails[size]), set(THUMBNAIL_FORMATS))
+            with default_storage.open(profile.thumbnails[size]['jpeg']) as f:
+                self.assertEqual(Image.open(f).size, (edge, edge))
+        self.assertTrue(profile.photo_url('small').endswith('_small.jpg'))
+
+        html = Template(
+            '{% load blog_tags %}{% avatar profile "small" %}'
+        ).render(Context({'profile': profile}))
+        self.assertIn(profile.photo_url('small'), html)
+
+    def test_new_upload_replaces_old_variants(self):
+        profile = self.upload('first.jpg')
+        build_thumbnails(profile.pk, profile.photo.name)
+        profile.refresh_from_db()
+        old = profile.thumbnails['small']['jpeg']
+
+        profile = self.upload('second.jpg')
+        self.assertEqual(profile.photo_url('small'), profile.photo.url)
+        build_thumbnails(profile.pk, profile.photo.name, stale={'small': {'jpeg': old}})
+        self.assertFalse(default_storage.exists(old))
+
+
+class StaticFilesTests(TestCase):
+    def setUp(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        self.enterContext(override_settings(
+            STATIC_ROOT=static_root,
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'blog.staticfiles.CompressedManifestStaticFilesStorage'},
+            },
+        ))
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.middleware = StaticFilesMiddleware(lambda request: None)
+        self.factory = RequestFactory()
+
+    def hashed_css_url(self):
+        url = static('blog/base.css')
+        self.assertRegex(url, r'^/static/blog/base\.[0-9a-f]{12}\.css$')
+        return url
+
+    def test_hashed_file_is_immutable_and_compressed(self):
+        url = self.hashed_css_url()
+        response = self.middleware(self.factory.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertTrue(response.headers['Content-Type'].startswith('text/css'))
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)).decode(),
+            Path(settings.STATIC_ROOT, url.removeprefix('/static/')).read_text(),
+        )
+
+        plain = self.middleware(self.factory.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0'))
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+        revalidated = self.middleware(self.factory.get(
+            url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response.headers['ETag']
+        ))
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_unhashed_name_is_not_immutable(self):
+        response = self.middleware(self.factory.get('/static/blog/base.css'))
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+        self.assertIsNone(self.middleware(self.factory.get('/static/missing.css')))
+
+    async def test_async_chain_is_served_without_a_thread_hop(self):
+        async def get_response(request):
+            return HttpResponse('view')
+
+        middleware = StaticFilesMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(self.factory.get('/static/blog/base.css'))
+        self.assertEqual(response.status_code, 200)
+        response = await middleware(self.factory.get('/static/missing.css'))
+        self.assertEqual(response.content, b'view')
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', 'author@example.com', 'pass')
+        cls.post = Post.objects.create(
+            title='Timed', slug='timed', author=author,
+            content='Some *content*', status='published',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.enterContext(mock.patch.object(metrics, 'registry', metrics.Registry()))
+
+    def test_disabled_by_default(self):
+        response = self.client.get(self.post.get_absolute_url())
+        self.assertNotIn('Server-Timing', response.headers)
+
+    @override_settings(BLOG_METRICS=True)
+    def test_server_timing_and_histograms(self):
+        url = self.post.get_absolute_url()
+        response = self.client.get(url)
+        timing = response.headers['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('template;dur=', timing)
+        self.assertIn('cache;desc="1 miss"', timing)
+
+        # Served from the page cache: no queries, no templates
+        response = self.client.get(url)
+        self.assertIn('db;dur=0.0;desc="0 queries"', response.headers['Server-Timing'])
+        self.assertIn('cache;desc="1 hit"', response.headers['Server-Timing'])
+
+        request = RequestFactory().get('/metrics')
+        request.user = User(is_staff=True, is_active=True)
+        body = metrics.metrics_view(request).content.decode()
+        self.assertIn('blog_request_duration_seconds_count{view="blog:post_detail"} 2', body)
+        self.assertIn('blog_db_queries_bucket{view="blog:post_detail",le="0"} 1', body)
+        self.assertIn('blog_cache_requests_total{view="blog:post_detail",result="hit"} 1', body)
+
+    @override_settings(BLOG_METRICS=True, BLOG_METRICS_TOKEN='s3cret')
+    def test_metrics_endpoint_needs_staff_or_the_token(self):
+        factory = RequestFactory()
+
+        def scrape(user=None, **headers):
+            request = factory.get('/metrics', REMOTE_ADDR='127.0.0.1', headers=headers)
+            request.user = user or AnonymousUser()
+            return metrics.metrics_view(request)
+
+        # A local address proves nothing behind a reverse proxy
+        with self.assertRaises(Http404):
+            scrape()
+        with self.assertRaises(Http404):
+            scrape(authorization='Bearer wrong')
+        with self.assertRaises(Http404):
+            scrape(User(is_active=True))
+        self.assertEqual(scrape(authorization='Bearer s3cret').status_code, 200)
+        self.assertEqual(scrape(User(is_staff=True, is_active=True)).status_code, 200)
+
+    def test_metrics_endpoint_is_not_routed_when_disabled(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        request = RequestFactory().get('/metrics')
+        request.user = User(is_staff=True, is_active=True)
+        with self.assertRaises(Http404):
+            metrics.metrics_view(request)
+
+
+class SeedCorpusTests(TestCase):
+    def test_seeded_counts_are_consistent(self):
+        call_command(
+            'seed_corpus', posts=20, comments=50, tags=5, authors=2, bodies=3,
+            workers=1, stdout=StringIO(),
+        )
+        self.assertEqual(Post.objects.count(), 20)
+        self.assertEqual(Comment.objects.count(), 50)
+        for post in Post.objects.all():
+            self.assertEqual(
+                post.approved_comment_count,
+                post.comments.filter(approved=True).count(),
+            )
+        self.assertEqual(
+            sum(TagStat.objects.values_list('published_count', flat=True)),
+            Post.published.count() * 3,
+        )
+        self.assertEqual(
+            set(RelatedPost.objects.values_list('post_id', flat=True)),
+            set(Post.published.values_list('pk', flat=True)),
+        )
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_comment_benchmark_stays_under_the_rate_limit(self):
+        call_command(
+            'seed_corpus', posts=20, comments=0, tags=5, authors=2, bodies=3,
+            workers=1, stdout=StringIO(),
+        )
+        out = StringIO()
+        call_command(
+            'benchmark', '--with-cache', scenario=['comment'], requests=12, warmup=2,
+            stdout=out,
+        )
+        self.assertEqual(json.loads(out.getvalue())['scenarios']['comment']['requests'], 12)
+
+
+@override_settings(BLOG_DATABASE_REPLICAS=['replica1'], BLOG_REPLICA_PIN_SECONDS=10)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.read_from = None
+
+        def view(request):
+            self.read_from = ReplicaRouter().db_for_read(Post)
+            return HttpResponse(status=302 if request.method == 'POST' else 200)
+
+        self.middleware = ReplicaPinningMiddleware(view)
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(ReplicaRouter().db_for_read(Post), 'default')
+        self.assertEqual(ReplicaRouter().db_for_write(Post), 'default')
+
+    def test_safe_requests_read_from_a_replica(self):
+        self.middleware(self.factory.get('/blog/'))
+        self.assertEqual(self.read_from, 'replica1')
+
+    def test_writes_pin_the_browser_to_the_primary(self):
+        response = self.middleware(self.factory.post('/blog/create/'))
+        self.assertEqual(self.read_from, 'default')
+
+        request = self.factory.get('/blog/')
+        request.COOKIES['blog_primary'] = response.cookies['blog_primary'].value
+        self.middleware(request)
+        self.assertEqual(self.read_from, 'default')
+
+        request.COOKIES['blog_primary'] = 'forged'
+        self.middleware(request)
+        self.assertEqual(self.read_from, 'replica1')
+
+
+@override_settings(BLOG_DATABASE_REPLICAS=['replica1'], BLOG_REPLICA_PIN_SECONDS=10)
+class ReplicaLagTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        # A second connection to the test database stands in for a replica
+        connections['replica1'] = connections['default'].copy('replica1')
+        self.addCleanup(connections.__delitem__, 'replica1')
+        self.addCleanup(lambda: connections['replica1'].close())
+        self.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        self.post = Post.objects.create(
+            title='Before', slug='lagging', author=self.author,
+            content='Body', status='published',
+        )
+
+    def test_pages_read_before_the_replica_catches_up_are_not_kept(self):
+        url = self.post.get_absolute_url()
+        with transaction.atomic(using='replica1'):
+            # The replica's snapshot predates the edit: it lags the primary
+            with connections['replica1'].cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                cursor.execute('SELECT 1 FROM blog_post')
+            self.post.title = 'After'
+            self.post.save()
+
+            response = self.client.get(url)
+            self.assertContains(response, 'Before')
+            self.assertNotIn('ETag', response.headers)
+            self.assertNotIn('Last-Modified', response.headers)
+
+        self.assertContains(self.client.get(url), 'After')
+
+        # Once the lag has passed, pages are cached and validated again
+        with override_settings(BLOG_REPLICA_PIN_SECONDS=0):
+            response = self.client.get(url)
+            self.assertIn('ETag', response.headers)
+            Post.objects.filter(pk=self.post.pk).update(title='Uncached')
+            self.assertContains(self.client.get(url), 'After')
+
+
+class FeedAndSitemapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post = Post.objects.create(
+                title='Syndicated', slug='syndicated', author=self.author,
+                content='Some *content*', status='published',
+            )
+            self.post.tags.add('django')
+
+    def test_feeds_use_stored_html_and_cache(self):
+        url = reverse('blog:post_feed')
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/rss+xml; charset=utf-8')
+        self.assertContains(response, '&lt;em&gt;content&lt;/em&gt;')
+        # Links come from the SITE_ID Site, whatever the request's host
+        self.assertContains(response, '<link>http://example.com/')
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+
+        revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        atom = self.client.get(reverse('blog:post_atom_feed_by_tag', args=['django']))
+        self.assertContains(atom, 'Syndicated')
+        self.assertTrue(atom['Content-Type'].startswith('application/atom+xml'))
+        self.assertEqual(
+            self.client.get(reverse('blog:post_feed_by_tag', args=['missing'])).status_code,
+            404,
+        )
+
+    def test_feed_is_regenerated_when_a_post_changes(self):
+        url = reverse('blog:post_feed')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.title = 'Renamed'
+            self.post.save()
+        self.assertContains(self.client.get(url), 'Renamed')
+
+    @mock.patch('blog.sitemaps.PostSitemap.limit', 1)
+    def test_sitemap_is_split_into_chunks(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(
+                title='Second', slug='second', author=self.author,
+                content='More', status='published',
+            )
+        index = self.client.get(reverse('blog:sitemap'))
+        section = reverse('blog:sitemap_section', args=['posts'])
+        self.assertContains(index, f'{section}</loc>')
+        self.assertContains(index, f'{section}?p=2</loc>')
+
+        page = self.client.get(section, {'p': 2})
+        self.assertContains(page, reverse('blog:post_detail', args=['second']))
+        self.assertNotContains(page, reverse('blog:post_detail', args=['syndicated']))
+
+
+class AdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.posts = []
+        for i in range(5):
+            post = Post.objects.create(
+                title=f'Admin post {i}', slug=f'admin-post-{i}', author=cls.admin,
+                content='Postgres tuning notes', status='draft',
+            )
+            post.tags.add('postgres')
+            cls.posts.append(post)
+            for _ in range(3):
+                Comment.objects.create(post=post, author=cls.admin, content='Hi')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelists_do_not_query_per_row(self):
+        url = reverse('admin:blog_comment_changelist')
+        # Session, user, row estimate, exact count (small table), the rows
+        with self.assertNumQueries(5):
+            self.client.get(url)
+        Comment.objects.bulk_create(
+            [Comment(post=self.posts[0], author=self.admin, content='More') for _ in range(10)]
+        )
+        with self.assertNumQueries(5):
+            self.client.get(url)
+
+    def test_post_search_uses_the_search_vector(self):
+        response = self.client.get(
+            reverse('admin:blog_post_changelist'), {'q': 'tuning'}
+        )
+        self.assertEqual(len(response.context['cl'].result_list), 5)
+        response = self.client.get(
+            reverse('admin:blog_post_changelist'), {'q': 'mysql'}
+        )
+        self.assertEqual(len(response.context['cl'].result_list), 0)
+
+    def test_publish_action_keeps_tag_stats_in_sync(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:blog_post_changelist'), {
+                'action': 'publish_posts',
+                admin.helpers.ACTION_CHECKBOX_NAME: [p.pk for p in self.posts[:3]],
+            })
+        self.assertEqual(Post.published.count(), 3)
+        self.assertEqual(TagStat.objects.get(tag__name='postgres').published_count, 3)
+        self.assertEqual(RelatedPost.objects.filter(post=self.posts[0]).count(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:blog_post_changelist'), {
+                'action': 'unpublish_posts',
+                admin.helpers.ACTION_CHECKBOX_NAME: [p.pk for p in self.posts],
+            })
+        self.assertEqual(Post.published.count(), 0)
+        self.assertEqual(TagStat.objects.get(tag__name='postgres').published_count, 0)
+        self.assertFalse(RelatedPost.objects.exists())
+
+    def test_approve_action_updates_counts(self):
+        self.client.post(reverse('admin:blog_comment_changelist'), {
+            'action': 'approve_comments',
+            admin.helpers.ACTION_CHECKBOX_NAME: list(
+                Comment.objects.filter(post=self.posts[0]).values_list('pk', flat=True)
+            ),
+        })
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].approved_comment_count, 3)
+
+
+@override_settings(BLOG_COMMENT_QUEUE='database', BLOG_COMMENT_RATE=(3, 60))
+class CommentQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', 'reader@example.com', 'pass')
+        cls.post = Post.objects.create(
+            title='Viral', slug='viral', author=cls.user,
+            content='Everyone comments', status='published',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def comment(self, text='Nice post'):
+        return self.client.post(self.post.get_absolute_url(), {'content': text})
+
+    def test_comments_are_queued_then_flushed_in_one_batch(self):
+        for i in range(3):
+            response = self.comment(f'Comment {i}')
+            self.assertEqual(response.status_code, 202)
+        self.assertEqual(QueuedComment.objects.count(), 3)
+        self.assertFalse(Comment.objects.exists())
+
+        # Claim, post and author lookups, insert, count update and ack, in a savepoint
+        with self.assertNumQueries(8):
+            self.assertEqual(flush(get_queue()), 3)
+        self.assertFalse(QueuedComment.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.approved_comment_count, 3)
+        self.assertEqual(flush(get_queue()), 0)
+
+    def test_rate_limit_applies_before_enqueueing(self):
+        for _ in range(3):
+            self.comment()
+        self.assertEqual(self.comment().status_code, 429)
+        self.assertEqual(QueuedComment.objects.count(), 3)
+
+    def test_spool_queue_keeps_comments_until_committed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        queue = SpoolQueue(directory)
+        queue.put({'post_id': self.post.pk, 'author_id': self.user.pk, 'content': 'Hi'})
+        queue.put({'post_id': 0, 'author_id': self.user.pk, 'content': 'Orphan'})
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            # The dropped orphan counts as flushed too
+            self.assertEqual(flush(queue), 2)
+            self.assertEqual(len(os.listdir(Path(directory, 'claimed'))), 2)
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(os.listdir(Path(directory, 'claimed')), [])
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(Comment.objects.get().content, 'Hi')
+
+    def test_comments_by_deleted_users_are_dropped(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        queue = SpoolQueue(directory)
+        leaver = User.objects.create_user('leaver', 'leaver@example.com', 'pass')
+        queue.put({'post_id': self.post.pk, 'author_id': leaver.pk, 'content': 'Bye'})
+        queue.put({'post_id': self.post.pk, 'author_id': self.user.pk, 'content': 'Hi'})
+        leaver.delete()
+
+        # A batch of only dropped comments still drains the queue
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush(queue, 1), 1)
+        self.assertFalse(Comment.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush(queue), 1)
+            self.assertEqual(flush(queue), 0)
+        self.assertEqual(Comment.objects.get().content, 'Hi')
+
+    def test_old_spooled_comment_is_not_reclaimed_once_claimed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        queue = SpoolQueue(directory)
+        queue.put({'post_id': self.post.pk, 'author_id': self.user.pk, 'content': 'Hi'})
+        # Spooled long before a worker got to it
+        name, = os.listdir(Path(directory, 'new'))
+        old = time.time() - queue.reclaim_after - 60
+        os.utime(Path(directory, 'new', name), (old, old))
+
+        self.assertEqual(len(queue.claim(10)), 1)
+        # A second worker must not take the claimed file back
+        self.assertEqual(queue.claim(10), [])
+
+        claimed = Path(directory, 'claimed', name)
+        os.utime(claimed, (old, old))
+        self.assertEqual(len(queue.claim(10)), 1)
+
+
+class RelatedPostTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+
+    def setUp(self):
+        cache.clear()
+
+    def create(self, slug, tags, status='published'):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title=slug.title(), slug=slug, author=self.author,
+                content='Body', status=status,
+            )
+            post.tags.add(*tags)
+        return post
+
+    def related_slugs(self, post):
+        return [link.related.slug for link in related_posts_for(post)]
+
+    def test_lists_are_ranked_and_kept_up_to_date(self):
+        a = self.create('a', ['python', 'postgres', 'rare'])
+        b = self.create('b', ['python', 'postgres'])
+        c = self.create('c', ['python', 'rare'])
+        self.create('d', ['cooking'])
+
+        # 'rare' is used by fewer posts than 'postgres', so it weighs more.
+        self.assertEqual(self.related_slugs(a), ['c', 'b'])
+        self.assertEqual(self.related_slugs(b), ['a', 'c'])
+
+        # Unpublishing removes the post from the lists it appeared in.
+        with self.captureOnCommitCallbacks(execute=True):
+            c.status = 'draft'
+            c.save()
+        self.assertEqual(self.related_slugs(a), ['b'])
+        self.assertEqual(self.related_slugs(c), [])
+
+        # A retag reaches the lists of the new neighbours.
+        with self.captureOnCommitCallbacks(execute=True):
+            d = Post.objects.get(slug='d')
+            d.tags.add('rare')
+        self.assertIn('d', self.related_slugs(a))
+
+    def test_rebuild_overwrites_rows_in_place(self):
+        a = self.create('a', ['python'])
+        self.create('b', ['python'])
+        c = self.create('c', ['cooking'])
+        # Rows another rebuild wrote meanwhile, one of them surplus
+        RelatedPost.objects.filter(post=a).delete()
+        RelatedPost.objects.bulk_create([
+            RelatedPost(post=a, related=c, rank=0, score=1),
+            RelatedPost(post=a, related=c, rank=1, score=1),
+        ])
+        rebuild([a.pk])
+        self.assertEqual(self.related_slugs(a), ['b'])
+
+    def test_failed_refresh_does_not_fail_the_committed_write(self):
+        post = self.create('a', ['python'], status='draft')
+        with mock.patch('blog.related.rebuild', side_effect=IntegrityError), \
+                self.assertLogs('django', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            post.status = 'published'
+            post.save()
+
+    def test_renaming_a_post_updates_the_pages_listing_it(self):
+        a = self.create('a', ['python'])
+        b = self.create('b', ['python'])
+        etag = self.client.get(a.get_absolute_url())['ETag']
+        old_url = b.get_absolute_url()
+        self.client.get(old_url)
+
+        b = Post.objects.get(pk=b.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            b.title = 'Renamed'
+            b.slug = 'renamed'
+            b.save()
+        response = self.client.get(a.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Renamed')
+        self.assertContains(response, reverse('blog:post_detail', args=['renamed']))
+        self.assertEqual(self.client.get(old_url).status_code, 404)
+
+    def test_detail_page_shows_related_posts(self):
+        a = self.create('a', ['python'])
+        self.create('b', ['python'])
+        response = self.client.get(a.get_absolute_url())
+        self.assertContains(response, 'Related posts')
+        self.assertContains(response, reverse('blog:post_detail', args=['b']))
+
+    def test_imported_posts_get_related_lists(self):
+        a = self.create('a', ['python'])
+        path = Path(tempfile.mkdtemp(), 'posts.jsonl')
+        self.addCleanup(shutil.rmtree, path.parent)
+        path.write_text(
+            '{"title": "Imported", "content": "Body", "tags": "python", "status": "published"}\n'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_posts', str(path), author='author', stdout=StringIO())
+        self.assertEqual(self.related_slugs(a), ['imported'])
+
+    def test_rebuild_command(self):
+        a = self.create('a', ['python'])
+        self.create('b', ['python'])
+        RelatedPost.objects.all().delete()
+        call_command('rebuild_related_posts', workers=1, stdout=StringIO())
+        self.assertEqual(self.related_slugs(a), ['b'])
+
+
+class ImportPostsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        Post.objects.create(title='Hello', slug='hello', author=cls.author, content='Body')
+
+    def import_posts(self, *records, batch_size=1000):
+        path = Path(tempfile.mkdtemp(), 'posts.jsonl')
+        self.addCleanup(shutil.rmtree, path.parent)
+        path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                'import_posts', str(path), author='author',
+                batch_size=batch_size, stdout=StringIO(),
+            )
+
+    def test_slugs_avoid_existing_rows_and_each_other(self):
+        self.import_posts(
+            {'title': 'Hello'}, {'title': 'Hello'}, {'title': 'Hello'}, {'title': 'Other'},
+            batch_size=2,
+        )
+        self.assertEqual(
+            list(Post.objects.order_by('pk').values_list('slug', flat=True)),
+            ['hello', 'hello-1', 'hello-2', 'hello-3', 'other'],
+        )
+
+    def test_bad_status_rejects_the_batch(self):
+        with self.assertRaisesMessage(CommandError, "Bad status 'bogus'"):
+            self.import_posts({'title': 'Fine'}, {'title': 'Bad', 'status': 'bogus'})
+        self.assertFalse(Post.objects.filter(title__in=['Fine', 'Bad']).exists())
+
+    def test_published_posts_update_stats_and_related_lists(self):
+        existing = Post.objects.get(slug='hello')
+        with self.captureOnCommitCallbacks(execute=True):
+            existing.status = 'published'
+            existing.save()
+            existing.tags.add('python')
+        self.import_posts({
+            'title': 'Imported', 'tags': ['python'], 'status': 'published',
+            'created': '2024-03-05T10:00:00',
+        })
+        post = Post.objects.get(slug='imported')
+        self.assertEqual(post.created, datetime(2024, 3, 5, 10, tzinfo=dt_timezone.utc))
+        self.assertEqual(MonthStat.objects.get(month='2024-03-01').published_count, 1)
+        self.assertEqual(TagStat.objects.get(tag__name='python').published_count, 2)
+        self.assertEqual(
+            [link.related.slug for link in related_posts_for(existing)], ['imported']
+        )
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        Post.objects.bulk_create([
+            Post(
+                title=f'Post {i}', slug=f'post-{i}', author=cls.author,
+                content='Notes on kafka', status='published',
+            )
+            for i in range(110)
+        ])
+        # A title match weighs more than any content match
+        Post.objects.create(
+            title='Kafka tuning', slug='kafka-tuning', author=cls.author,
+            content='<img src=x onerror=alert(1)> kafka <b', status='published',
+        )
+
+    def search(self, **params):
+        return self.client.get(reverse('blog:post_search'), {'query': 'kafka', **params})
+
+    def test_best_match_comes_first(self):
+        results = self.search().context['results']
+        self.assertEqual(results[0].slug, 'kafka-tuning')
+
+    def test_results_are_capped_and_paginated(self):
+        results = self.search().context['results']
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results.paginator.count, 100)
+        last = self.search(page=99).context['results']
+        self.assertEqual(last.number, 10)
+
+    def test_headline_content_is_escaped(self):
+        response = self.search()
+        self.assertContains(
+            response, '&lt;img src=x onerror=alert(1)&gt; <mark>kafka</mark>'
+        )
+        self.assertNotContains(response, '<img src=x')
+
+
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', 'author@example.com', 'pass')
+        for slug, title, status in [
+            ('older', 'Caching pages', 'published'),
+            ('newer', 'Caching querysets', 'published'),
+            ('inner', 'Page caching in Django', 'published'),
+            ('draft', 'Caching drafts', 'draft'),
+        ]:
+            post = Post.objects.create(
+                title=title, slug=slug, author=author, content='Body', status=status,
+            )
+            post.tags.add('caching' if status == 'published' else 'cachet')
+
+    def setUp(self):
+        cache.clear()
+
+    def suggest(self, q):
+        response = self.client.get(reverse('blog:post_suggest'), {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefix_matches_come_first(self):
+        data = self.suggest('  CACH ')
+        self.assertEqual(data['query'], 'cach')
+        self.assertEqual(
+            [post['title'] for post in data['posts']],
+            ['Caching querysets', 'Caching pages', 'Page caching in Django'],
+        )
+        self.assertEqual(data['tags'], [
+            {'name': 'caching', 'url': reverse('blog:post_list_by_tag', args=['caching'])}
+        ])
+
+    def test_short_prefixes_are_not_looked_up(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('ca'), {'query': 'ca', 'posts': [], 'tags': []})
+
+    def test_lookups_match_the_trigram_index_expressions(self):
+        # Migration 0017 indexes UPPER(title::text) and UPPER(name::text)
+        with CaptureQueriesContext(connection) as captured:
+            self.suggest('cach')
+        sql = ' '.join(query['sql'] for query in captured)
+        self.assertIn('UPPER("blog_post"."title"::text) LIKE UPPER(', sql)
+        self.assertIn('UPPER("taggit_tag"."name"::text) LIKE UPPER(', sql)
+
+    def test_hot_prefixes_are_cached(self):
+        self.suggest('cach')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('blog:post_suggest'), {'q': 'cach'})
+        self.assertEqual(len(response.json()['posts']), 3)
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+
+@override_settings(ALLOWED_HOSTS=['blog.example.com'])
+class ExportHtmlTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', 'author@example.com', 'pass')
+        cls.post = Post.objects.create(
+            title='Exported', slug='exported', author=author, content='Body', status='published',
+        )
+        cls.post.tags.add('django')
+
+    def setUp(self):
+        cache.clear()
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def export(self, *args):
+        out = StringIO()
+        call_command('export_html', str(self.root), '--workers=1', *args, stdout=out)
+        return out.getvalue()
+
+    def page(self, url):
+        return self.root / url.strip('/') / 'index.html'
+
+    def test_exports_pages_with_gzipped_copies(self):
+        self.assertIn('Exported 3 page(s)', self.export())
+        detail = self.page(self.post.get_absolute_url())
+        self.assertIn(b'Exported', detail.read_bytes())
+        self.assertEqual(
+            gzip.decompress(detail.with_name('index.html.gz').read_bytes()),
+            detail.read_bytes(),
+        )
+        self.assertTrue(self.page(reverse('blog:post_list')).exists())
+        self.assertTrue(self.page(reverse('blog:post_list_by_tag', args=['django'])).exists())
+
+    def test_only_changed_pages_are_rendered_again(self):
+        self.export()
+        self.assertIn('Exported 0 page(s)', self.export())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.title = 'Edited'
+            self.post.save()
+        self.assertIn('Exported 3 page(s)', self.export())
+        self.assertIn(b'Edited', self.page(self.post.get_absolute_url()).read_bytes())
+        self.assertIn('Exported 3 page(s)', self.export('--all'))
+
+    def test_unpublished_posts_are_removed(self):
+        self.export()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.status = 'draft'
+            self.post.save()
+        self.assertIn('removed 2', self.export())
+        self.assertFalse(self.page(self.post.get_absolute_url()).exists())
+
+    def test_related_lists_and_sidebars_are_part_of_the_version(self):
+        self.export()
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Post.objects.create(
+                title='Neighbour', slug='neighbour', author=self.post.author,
+                content='Body', status='published',
+            )
+            other.tags.add('django')
+        # Both details (related lists), the list and tag pages (sidebars)
+        self.assertIn('Exported 4 page(s)', self.export())
+        self.assertIn(
+            other.get_absolute_url().encode(),
+            self.page(self.post.get_absolute_url()).read_bytes(),
+        )
+
+    def test_rerendered_posts_are_exported_again(self):
+        self.export()
+        # update() leaves `updated` alone, as a renderer upgrade would
+        Post.objects.filter(pk=self.post.pk).update(content='Rewritten')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rerender_posts', stdout=StringIO())
+        self.assertIn('Exported 1 page(s)', self.export())
+        self.assertIn(b'Rewritten', self.page(self.post.get_absolute_url()).read_bytes())
+
+    def test_failing_page_does_not_abort_the_export(self):
+        with mock.patch('blog.views.related_posts_for', side_effect=RuntimeError):
+            self.assertIn('Exported 2 page(s), removed 0, 1 failed.', self.export())
+        self.assertIn('Exported 1 page(s)', self.export())
+
+
+class DashboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+        cls.reader = User.objects.create_user('reader', 'reader@example.com', 'pass')
+        cls.published = Post.objects.create(
+            title='Out', slug='out', author=cls.author, content='Body', status='published',
+        )
+        for i in range(3):
+            Post.objects.create(title=f'Draft {i}', slug=f'draft-{i}', author=cls.author, content='wip')
+        Comment.objects.create(post=cls.published, author=cls.reader, content='Hi', approved=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.author)
+
+    def test_counts_by_status(self):
+        response = self.client.get(reverse('blog:dashboard'))
+        self.assertEqual(response.context['stats'], {
+            'draft': {'posts': 3, 'comments': 0},
+            'published': {'posts': 1, 'comments': 1},
+        })
+        self.assertEqual([post.slug for post in response.context['posts']], [
+            'draft-2', 'draft-1', 'draft-0',
+        ])
+
+    @override_settings(BLOG_COMMENT_QUEUE=None)
+    def test_stats_are_cached_until_the_author_writes(self):
+        self.client.get(reverse('blog:dashboard'))
+        # Session, user and the page of drafts; the stats come from the cache.
+        with self.assertNumQueries(3):
+            self.client.get(reverse('blog:dashboard'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(
+                post=self.published, author=self.reader, content='Again', approved=True,
+            )
+        response = self.client.get(reverse('blog:dashboard'))
+        self.assertEqual(response.context['stats']['published']['comments'], 2)
+
+    def test_drafts_are_paginated(self):
+        with mock.patch('blog.views.DASHBOARD_POSTS_PER_PAGE', 2):
+            first = self.client.get(reverse('blog:dashboard'))
+            self.assertEqual(len(first.context['posts']), 2)
+            second = self.client.get(
+                reverse('blog:dashboard'), {'cursor': first.context['posts'].next_cursor}
+            )
+        self.assertEqual([post.slug for post in second.context['posts']], ['draft-0'])
+
+    def test_published_filter_shows_comment_counts(self):
+        response = self.client.get(reverse('blog:dashboard'), {'status': 'published'})
+        self.assertContains(response, '1 comment')
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'pass')
+
+    def setUp(self):
+        cache.clear()
+
+    def create(self, slug, created, status='published'):
+        post = Post.objects.create(
+            title=slug.title(), slug=slug, author=self.author, content='Body', status=status,
+        )
+        Post.objects.filter(pk=post.pk).update(created=created)
+        post.refresh_from_db()
+        return post
+
+    def test_month_counts_follow_publishing(self):
+        post = Post.objects.create(
+            title='New', slug='new', author=self.author, content='Body', status='published',
+        )
+        month = month_of(post.created)
+        self.assertEqual(MonthStat.objects.get(month=month).published_count, 1)
+        post.status = 'draft'
+        post.save()
+        self.assertEqual(MonthStat.objects.get(month=month).published_count, 0)
+        post.status = 'published'
+        post.save()
+        post.delete()
+        self.assertEqual(MonthStat.objects.get(month=month).published_count, 0)
+
+    def test_month_page_uses_a_created_range(self):
+        self.create('march', datetime(2024, 3, 31, 23, 59, tzinfo=dt_timezone.utc))
+        self.create('april', datetime(2024, 4, 1, tzinfo=dt_timezone.utc))
+        self.create('draft', datetime(2024, 3, 2, tzinfo=dt_timezone.utc), status='draft')
+        url = reverse('blog:post_archive_month', args=[2024, 3])
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual([post.slug for post in response.context['posts']], ['march'])
+        self.assertContains(response, 'Posts from March 2024')
+        sql = captured[0]['sql']
+        self.assertIn('"blog_post"."created" >=', sql)
+        self.assertNotIn('EXTRACT', sql)
+
+    def test_sidebar_lists_months_with_counts(self):
+        self.create('march', datetime(2024, 3, 5, tzinfo=dt_timezone.utc))
+        refresh_month_stats()
+        response = self.client.get(reverse('blog:post_list'))
+        self.assertContains(response, reverse('blog:post_archive_month', args=[2024, 3]))
+        self.assertContains(response, 'March 2024</a> (1)')
+
+    def test_tag_pages_show_the_new_month_counts(self):
+        url = reverse('blog:post_list_by_tag', args=['alpha'])
+        self.create('march', datetime(2024, 3, 5, tzinfo=dt_timezone.utc), status='draft')
+        Post.objects.get(slug='march').tags.add('alpha')
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Archive')
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(
+                title='New', slug='new', author=self.author, content='Body', status='published',
+            )
+        response = self.client.get(url)
+        self.assertContains(response, f'{timezone.now():%B %Y}</a> (1)')
+
+    def test_invalid_month_is_404(self):
+        for year, month in [(2024, 13), (2024, 0), (9999, 12), (10000, 1)]:
+            response = self.client.get(reverse('blog:post_archive_month', args=[year, month]))
+            self.assertEqual(response.status_code, 404)
+
+
+class AllocateSlugsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('author', 'author@example.com', 'pass')
+        for slug in ['hello', 'hello-1', 'hello-world', 'hello_2']:
+            Post.objects.create(title=slug, slug=slug, author=author, content='Body')
+
+    def test_suffixes_skip_taken_slugs_in_the_database_and_batch(self):
+        with CaptureQueriesContext(connection) as captured:
+            slugs = allocate_slugs(['Hello', 'Hello', 'Hello World', 'New'])
+        self.assertEqual(slugs, ['hello-2', 'hello-3', 'hello-world-1', 'new'])
+        self.assertEqual(len(captured), 1)
+        self.assertNotIn('~', captured[0]['sql'])
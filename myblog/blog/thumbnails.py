@@ -0,0 +1,115 @@
+"""
+Resized copies of profile photos.
+
+Uploads are stored as-is by the request; the variants listed in
+THUMBNAIL_SIZES are built afterwards on a small thread pool and recorded
+in Profile.thumbnails, so pages never serve the original upload.
+"""
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Square avatar edge lengths in pixels
+THUMBNAIL_SIZES = {
+    'small': 48,
+    'medium': 128,
+    'large': 320,
+}
+
+# WebP first when this Pillow build can write it, JPEG as the fallback
+THUMBNAIL_FORMATS = (['webp'] if features.check('webp') else []) + ['jpeg']
+
+_SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True},
+}
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BLOG_THUMBNAIL_WORKERS', 2),
+    thread_name_prefix='thumbnails',
+)
+
+
+def variant_name(name, size, fmt):
+    stem, _ = posixpath.splitext(name)
+    return f'{stem}_{size}.{"jpg" if fmt == "jpeg" else fmt}'
+
+
+def render_variants(name, storage=default_storage):
+    """
+    Write every size and format of the photo stored at `name`.
+
+    Returns {size: {format: stored name}}.
+    """
+    with storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        # Let JPEG decode at a reduced scale when the original is huge.
+        image.draft('RGB', (max(THUMBNAIL_SIZES.values()),) * 2)
+        # Phones store rotation in EXIF; bake it in before resizing.
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    variants = {}
+    for size, edge in THUMBNAIL_SIZES.items():
+        thumb = ImageOps.fit(image, (edge, edge), Image.Resampling.LANCZOS)
+        variants[size] = {}
+        for fmt in THUMBNAIL_FORMATS:
+            buffer = BytesIO()
+            thumb.save(buffer, **_SAVE_OPTIONS[fmt])
+            target = variant_name(name, size, fmt)
+            if storage.exists(target):
+                storage.delete(target)
+            variants[size][fmt] = storage.save(target, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def delete_variants(variants, storage=default_storage):
+    for formats in variants.values():
+        for name in formats.values():
+            storage.delete(name)
+
+
+def build_thumbnails(profile_id, name, stale=None):
+    """Render the variants of `name` and record them on the profile."""
+    from .models import Profile
+
+    if stale:
+        delete_variants(stale)
+    if not name:
+        return {}
+    variants = render_variants(name)
+    # Skip the write if another upload replaced the photo meanwhile.
+    updated = Profile.objects.filter(pk=profile_id, photo=name).update(
+        thumbnails=variants
+    )
+    if not updated:
+        delete_variants(variants)
+    return variants
+
+
+def thumbnail_task(profile_id, name, stale=None):
+    """build_thumbnails() for pool threads, which no request cycle cleans up."""
+    close_old_connections()
+    try:
+        return build_thumbnails(profile_id, name, stale)
+    except Exception:
+        logger.exception('Could not build thumbnails for %s', name)
+        raise
+    finally:
+        close_old_connections()
+
+
+def schedule_thumbnails(profile, stale=None):
+    """Build thumbnails for `profile.photo` on the pool once the save commits."""
+    profile_id, name = profile.pk, profile.photo.name
+    transaction.on_commit(
+        lambda: _executor.submit(thumbnail_task, profile_id, name, stale)
+    )
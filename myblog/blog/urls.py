@@ -1,12 +1,21 @@
+from django.conf import settings
 from django.contrib.auth import views as auth_views
-from django.urls import path
-from . import views
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+from . import api, async_views, views
 
 
 app_name = 'blog'
 
+# Read paths served by the async views when running under ASGI
+read_views = async_views if settings.BLOG_ASYNC_VIEWS else views
+
+router = DefaultRouter()
+router.register('posts', api.PostViewSet, basename='api-post')
+router.register('tags', api.TagViewSet, basename='api-tag')
+
 urlpatterns = [
-    path('', views.post_list, name='post_list'),
+    path('', read_views.post_list, name='post_list'),
 
 
     # Authentication
@@ -44,13 +53,27 @@ urlpatterns = [
         ),
 
     path('account/', views.account, name='account'),
+    path('dashboard/', views.dashboard, name='dashboard'),
     path('register/', views.register, name='register'),
     path('edit/', views.edit, name='edit'),
-    path('search/', views.post_search, name='post_search'),
-    path('tag/<slug:tag_slug>/', views.post_list, name='post_list_by_tag'),
+    path('search/', read_views.post_search, name='post_search'),
+    path('search/suggest/', views.post_suggest, name='post_suggest'),
+    path('tag/<slug:tag_slug>/', read_views.post_list, name='post_list_by_tag'),
+    path('<int:year>/<int:month>/', views.post_archive_month, name='post_archive_month'),
+
+    # Feeds and sitemap
+    path('feed/', views.post_feed, name='post_feed'),
+    path('feed/atom/', views.post_atom_feed, name='post_atom_feed'),
+    path('tag/<slug:tag_slug>/feed/', views.post_feed, name='post_feed_by_tag'),
+    path('tag/<slug:tag_slug>/feed/atom/', views.post_atom_feed, name='post_atom_feed_by_tag'),
+    path('sitemap.xml', views.sitemap_index, name='sitemap'),
+    path('sitemap-<section>.xml', views.sitemap_section, name='sitemap_section'),
+
+    # Read-only API
+    path('api/', include(router.urls)),
 
     path('create/', views.post_create, name='post_create'),
-    path('<slug:slug>/', views.post_detail, name='post_detail'),
+    path('<slug:slug>/', read_views.post_detail, name='post_detail'),
     path('edit/<slug:slug>/', views.post_edit, name='post_edit'),
     path('delete/<slug:slug>/', views.post_delete, name='post_delete'),
 
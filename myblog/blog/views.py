@@ -1,14 +1,26 @@
+import hashlib
+from datetime import datetime
+
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
-from django.contrib.postgres.search import SearchVector
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Q
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sitemaps import views as sitemap_views
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Count, F, Q, Sum
 from django.shortcuts import get_object_or_404, redirect, render
-import markdown
-from django.utils.safestring import mark_safe
-from .models import Comment, Post, Profile
-from taggit.models import Tag
+from .cache import cache_anonymous_page, cached_value, conditional_page, get_tag
+from .comment_queue import allow_comment, get_queue
+from .feeds import AtomLatestPostsFeed, LatestPostsFeed
+from .metrics import record_cache
+from .models import SEARCH_CONFIG, Comment, Post, Profile
+from .pagination import CursorPaginator
+from .related import related_posts_for
+from .sitemaps import SITEMAPS
+from taggit.models import Tag, TaggedItem
 from .forms import (
     CommentForm,
     LoginForm,
@@ -18,7 +30,12 @@ from .forms import (
     ProfileEditForm,
     SearchForm,
 )
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 
 # Create your views here.
 
@@ -41,8 +58,8 @@ def register(request):
             new_user.set_password(
                 user_form.cleaned_data['password']
             )
+            # The create_user_profile signal adds the Profile
             new_user.save()
-            Profile.objects.get_or_create(user=new_user)
             return render(
                 request,
                 'blog/register_done.html',
@@ -63,22 +80,26 @@ def register(request):
 
 @login_required
 def edit(request):
+    # Accounts from before profiles were created on sign-up may lack one
+    profile, _ = Profile.objects.get_or_create(user=request.user)
     if request.method == 'POST':
         user_form = UserEditForm(
             instance=request.user,
             data=request.POST
         )
         profile_form = ProfileEditForm(
-            instance=request.user.profile,
+            instance=profile,
             data=request.POST,
             files=request.FILES
         )
         if user_form.is_valid() and profile_form.is_valid():
-            user_form.save()
-            profile_form.save()
+            # Write only the forms, and the columns, that changed
+            for form in (user_form, profile_form):
+                if form.has_changed():
+                    form.save(commit=False).save(update_fields=form.changed_data)
     else:
         user_form = UserEditForm(instance=request.user)
-        profile_form = ProfileEditForm(instance=request.user.profile)
+        profile_form = ProfileEditForm(instance=profile)
     return render(
         request,
         'blog/edit.html',
@@ -88,58 +109,238 @@ def edit(request):
         }
     )
 
+POSTS_PER_PAGE = 3
+
+
+def post_list_namespaces(tag_slug=None):
+    return ['lists', f'tag:{tag_slug}' if tag_slug else 'list']
+
+
+def published_posts_for(tag=None):
+    published_posts = (
+        Post.published.exclude(slug="")
+        .select_related('author')
+        .prefetch_related('tags')
+        .defer('content_html', 'search_vector')
+    )
+    if tag is not None:
+        # A semi-join on the tag's tagged items, using taggit's tag_id index
+        published_posts = published_posts.filter(
+            pk__in=TaggedItem.objects.filter(
+                tag_id=tag.pk,
+                content_type=ContentType.objects.get_for_model(Post),
+            ).values('object_id')
+        )
+    return published_posts
+
+
+def get_tag_or_404(tag_slug):
+    tag = get_tag(tag_slug)
+    if tag is None:
+        raise Http404('No Tag matches the given query.')
+    return tag
+
+
+def author_stats(user):
+    """
+    {status: {'posts': n, 'comments': n}} for the posts of `user`, from one
+    grouped query over the denormalized comment counts, cached per author.
+    """
+    def compute():
+        stats = {
+            status: {'posts': 0, 'comments': 0} for status, _ in Post.STATUS_CHOICES
+        }
+        rows = (
+            Post.objects.filter(author=user)
+            .order_by()
+            .values_list('status')
+            .annotate(posts=Count('pk'), comments=Sum('approved_comment_count'))
+        )
+        for status, posts, comments in rows:
+            stats[status] = {'posts': posts, 'comments': comments}
+        return stats
+    return cached_value('author_stats', [f'author:{user.pk}'], compute)
+
+
+@conditional_page(post_list_namespaces)
+@cache_anonymous_page(post_list_namespaces)
 def post_list(request, tag_slug=None):
-    published_posts = Post.published.exclude(slug="").order_by('-created')
-
-    tag = None
-    if tag_slug:
-        tag = get_object_or_404(Tag, slug=tag_slug)
-        published_posts = published_posts.filter(tags__in=[tag])
-
-    paginator = Paginator(published_posts, 3)
-    page_number = request.GET.get('page', 1)
-    try:
-        posts = paginator.page(page_number)
-    except PageNotAnInteger:
-        posts = paginator.page(1)
-    except EmptyPage:
-        posts = paginator.page(paginator.num_pages)
-
-    user_drafts = []
+    tag = get_tag_or_404(tag_slug) if tag_slug else None
+    published_posts = published_posts_for(tag)
+
+    paginator = CursorPaginator(published_posts, POSTS_PER_PAGE)
+    posts = paginator.page(request.GET.get('cursor'))
+
+    draft_count = 0
     if request.user.is_authenticated:
-        user_drafts = Post.objects.filter(author=request.user, status='draft')
+        draft_count = author_stats(request.user)['draft']['posts']
 
     return render(
         request,
         'blog/post_list.html',
         {
             'posts': posts,
-            'drafts': user_drafts,
+            'draft_count': draft_count,
             'tag': tag
         }
     )
 
 
-def post_detail(request, slug):
-    if request.user.is_authenticated:
-        post = get_object_or_404(
-            Post,
-            Q(status='published') | Q(author=request.user),
-            slug=slug
-        )
-    else:
-        post = get_object_or_404(Post.published, slug=slug)
+DASHBOARD_POSTS_PER_PAGE = 20
+
+
+@login_required
+def dashboard(request):
+    status = request.GET.get('status')
+    if status not in dict(Post.STATUS_CHOICES):
+        status = 'draft'
+    posts = Post.objects.filter(author=request.user, status=status).only(
+        'title', 'slug', 'status', 'created', 'updated', 'approved_comment_count'
+    )
+    paginator = CursorPaginator(posts, DASHBOARD_POSTS_PER_PAGE)
+    return render(
+        request,
+        'blog/dashboard.html',
+        {
+            'section': 'dashboard',
+            'stats': author_stats(request.user),
+            'status': status,
+            'posts': paginator.page(request.GET.get('cursor')),
+        }
+    )
+
+
+def archive_namespaces(year, month):
+    # Publishing, unpublishing or editing any post bumps 'list' already
+    return post_list_namespaces()
+
+
+@conditional_page(archive_namespaces)
+@cache_anonymous_page(archive_namespaces)
+def post_archive_month(request, year, month):
+    # December 9999 has no next month to end the range at
+    if not 1 <= month <= 12 or not 1 <= year <= 9999 or (year, month) == (9999, 12):
+        raise Http404('No archive for this month.')
+    start = timezone.make_aware(datetime(year, month, 1))
+    end = timezone.make_aware(
+        datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    )
+    # A range on created, not created__year/__month, so the (-created, -id)
+    # index serves both the filter and the order.
+    published_posts = published_posts_for().filter(created__gte=start, created__lt=end)
+
+    paginator = CursorPaginator(published_posts, POSTS_PER_PAGE)
+    return render(
+        request,
+        'blog/post_list.html',
+        {
+            'posts': paginator.page(request.GET.get('cursor')),
+            'month': start,
+        }
+    )
+
+
+COMMENTS_PER_PAGE = 20
+
+
+rss_feed = LatestPostsFeed()
+atom_feed = AtomLatestPostsFeed()
 
-    post.content_html = mark_safe(markdown.markdown(
-        post.content,
-        extensions=['fenced_code', 'codehilite', 'tables', 'nl2br']
-    ))
 
-    comments = post.comments.filter(approved=True)
+# Feeds cover the same posts as the matching list page, so they share its
+# generations: polls are answered from the cache, or with a 304, until a
+# post changes.
+@conditional_page(post_list_namespaces)
+@cache_anonymous_page(post_list_namespaces)
+def post_feed(request, tag_slug=None):
+    return rss_feed(request, tag_slug=tag_slug)
+
+
+@conditional_page(post_list_namespaces)
+@cache_anonymous_page(post_list_namespaces)
+def post_atom_feed(request, tag_slug=None):
+    return atom_feed(request, tag_slug=tag_slug)
+
+
+def sitemap_namespaces(section=None):
+    # Every post save bumps 'list'
+    return ['list']
+
+
+@conditional_page(sitemap_namespaces)
+@cache_anonymous_page(sitemap_namespaces)
+def sitemap_index(request):
+    return sitemap_views.index(
+        request, SITEMAPS, sitemap_url_name='blog:sitemap_section'
+    ).render()
+
+
+@conditional_page(sitemap_namespaces)
+@cache_anonymous_page(sitemap_namespaces)
+def sitemap_section(request, section):
+    return sitemap_views.sitemap(request, SITEMAPS, section=section).render()
+
+
+def post_detail_namespaces(slug):
+    return [f'post:{slug}']
+
+
+def visible_posts_for(user):
+    """Published posts, plus the user's own drafts"""
+    posts = Post.objects.select_related('author').defer('search_vector')
+    if user.is_authenticated:
+        return posts.filter(Q(status='published') | Q(author=user))
+    return posts.filter(status='published')
+
+
+def comments_paginator(post):
+    return CursorPaginator(
+        post.comments.filter(approved=True)
+        .select_related('author')
+        .only('content', 'created', 'author__username'),
+        COMMENTS_PER_PAGE,
+        ordering=('created', 'id'),
+    )
+
+
+def store_rendered_content(post):
+    return Post.objects.filter(pk=post.pk).update(
+        content_html=post.content_html,
+        content_hash=post.content_hash,
+        renderer_version=post.renderer_version,
+    )
+
+
+@conditional_page(post_detail_namespaces)
+@cache_anonymous_page(post_detail_namespaces)
+def post_detail(request, slug):
+    post = get_object_or_404(visible_posts_for(request.user), slug=slug)
+
+    # Rows saved before the renderer changed are healed on first view;
+    # `rerender_posts` does the same in bulk.
+    if post.render_content():
+        store_rendered_content(post)
 
     if request.method == 'POST':
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
         comment_form = CommentForm(request.POST)
         if comment_form.is_valid():
+            if not allow_comment(request.user):
+                return HttpResponse(
+                    'You are commenting too fast; try again in a minute.', status=429
+                )
+            queue = get_queue()
+            if queue is not None:
+                queue.put({
+                    'post_id': post.pk,
+                    'author_id': request.user.pk,
+                    'content': comment_form.cleaned_data['content'],
+                })
+                # A small page instead of redirecting to a full re-render
+                return render(
+                    request, 'blog/comment_queued.html', {'post': post}, status=202
+                )
             comment = comment_form.save(commit=False)
             comment.post = post
             comment.author = request.user
@@ -150,6 +351,8 @@ def post_detail(request, slug):
     else:
         comment_form = CommentForm()
 
+    comments = comments_paginator(post).page(request.GET.get('cursor'))
+
     return render(
         request,
         'blog/post_detail.html',
@@ -157,6 +360,7 @@ def post_detail(request, slug):
             'comments': comments,
             'comment_form': comment_form,
             'post': post,
+            'related': related_posts_for(post),
         }
     )
 
@@ -240,6 +444,52 @@ def post_delete(request, slug):
         }
     )
 
+SEARCH_RESULTS_LIMIT = 100
+SEARCH_RESULTS_PER_PAGE = 10
+
+
+def search_matches(search_query):
+    return (
+        Post.published.filter(search_vector=search_query)
+        .annotate(rank=SearchRank(F('search_vector'), search_query))
+        .order_by('-rank', '-id')
+        .select_related('author')
+        .prefetch_related('tags')
+        .defer('content', 'content_html', 'search_vector')
+    )
+
+
+# Control characters Postgres puts around matches; the content itself is
+# escaped before they become <mark> tags.
+HEADLINE_START = '\x02'
+HEADLINE_STOP = '\x03'
+
+
+def search_headlines(posts, search_query):
+    """(pk, headline) pairs, built only for the posts on the current page"""
+    return (
+        Post.objects.filter(pk__in=[post.pk for post in posts])
+        .annotate(headline=SearchHeadline(
+            'content',
+            search_query,
+            config=SEARCH_CONFIG,
+            start_sel=HEADLINE_START,
+            stop_sel=HEADLINE_STOP,
+            max_words=35,
+        ))
+        .values_list('pk', 'headline')
+    )
+
+
+def highlight(headline):
+    """A raw headline as safe HTML: the snippet escaped, matches in <mark>."""
+    return mark_safe(
+        escape(headline)
+        .replace(HEADLINE_START, '<mark>')
+        .replace(HEADLINE_STOP, '</mark>')
+    )
+
+
 def post_search(request):
     form = SearchForm()
     query = None
@@ -249,12 +499,17 @@ def post_search(request):
         form = SearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data['query']
-            results = (
-                Post.published.annotate(
-                    search=SearchVector('title', 'content'),
-                )
-                .filter(search=query)
+            search_query = SearchQuery(query, config=SEARCH_CONFIG)
+            # Only the best matches are paginated, so counting and paging
+            # stay bounded however many posts match.
+            paginator = Paginator(
+                search_matches(search_query)[:SEARCH_RESULTS_LIMIT],
+                SEARCH_RESULTS_PER_PAGE,
             )
+            results = paginator.get_page(request.GET.get('page'))
+            headlines = dict(search_headlines(results, search_query))
+            for post in results:
+                post.headline = highlight(headlines.get(post.pk, ''))
 
     return render(
         request,
@@ -265,3 +520,67 @@ def post_search(request):
             'results': results,
         }
     )
+
+
+SUGGEST_MIN_LENGTH = 3
+SUGGEST_MAX_LENGTH = 50
+SUGGEST_LIMIT = 8
+SUGGEST_CACHE_TIMEOUT = 60
+
+
+def title_suggestions(prefix, limit):
+    """Titles starting with `prefix`, then titles containing it, newest first."""
+    posts = Post.published.order_by('-created', '-id').values_list('title', 'slug')
+    found = list(posts.filter(title__istartswith=prefix)[:limit])
+    if len(found) < limit:
+        found += posts.filter(title__icontains=prefix).exclude(
+            title__istartswith=prefix
+        )[:limit - len(found)]
+    return found
+
+
+def tag_suggestions(prefix, limit):
+    """Names of tags in use containing `prefix`, the most used first."""
+    return (
+        Tag.objects.filter(name__icontains=prefix, stat__published_count__gt=0)
+        .order_by('-stat__published_count', 'name')
+        .values_list('name', 'slug')[:limit]
+    )
+
+
+def suggestions(prefix):
+    # Hot prefixes are shared by many visitors; a short timeout keeps them
+    # close enough to current without invalidating on every write.
+    key = 'blog:suggest:' + hashlib.md5(prefix.encode()).hexdigest()
+    payload = cache.get(key)
+    record_cache(payload is not None)
+    if payload is None:
+        payload = {
+            'posts': [
+                {'title': title, 'url': reverse('blog:post_detail', args=[slug])}
+                for title, slug in title_suggestions(prefix, SUGGEST_LIMIT)
+            ],
+            'tags': [
+                {'name': name, 'url': reverse('blog:post_list_by_tag', args=[slug])}
+                for name, slug in tag_suggestions(prefix, SUGGEST_LIMIT)
+            ],
+        }
+        cache.set(key, payload, SUGGEST_CACHE_TIMEOUT)
+    return payload
+
+
+def post_suggest(request):
+    """
+    Titles and tags for search-as-you-type, as JSON. The case-insensitive
+    lookups are served by the trigram indexes (migration 0017), so prefixes
+    shorter than SUGGEST_MIN_LENGTH, which yield no trigram to look up, get
+    nothing.
+    """
+    prefix = ' '.join(request.GET.get('q', '').split()).lower()[:SUGGEST_MAX_LENGTH]
+    if len(prefix) < SUGGEST_MIN_LENGTH:
+        payload = {'posts': [], 'tags': []}
+    else:
+        payload = suggestions(prefix)
+    response = JsonResponse({'query': prefix, **payload})
+    patch_cache_control(response, public=True, max_age=SUGGEST_CACHE_TIMEOUT)
+    return response
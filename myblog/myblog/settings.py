@@ -31,6 +31,11 @@ DEBUG = os.getenv('DEBUG', 'True') == 'True'
 
 ALLOWED_HOSTS = []
 
+# The Site feeds and sitemaps build absolute links from; set its domain in
+# the admin. Without it they look the Site up by request host and fail on
+# any host that has no Site row.
+SITE_ID = int(os.getenv('SITE_ID', '1'))
+
 
 # Application definition
 
@@ -51,12 +56,16 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.postgres',
+    'django.contrib.sitemaps',
     'taggit',
 ]
 
 MIDDLEWARE = [
+    'blog.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'blog.middleware.StaticFilesMiddleware',
+    'blog.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -69,7 +78,8 @@ ROOT_URLCONF = 'myblog.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Times renders for blog.metrics; otherwise the stock Django backend
+        'BACKEND': 'blog.metrics.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -97,9 +107,34 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD', 'etoro111'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # Seconds to keep connections open between requests (0 closes them)
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas as comma-separated host[:port]; safe requests read from
+# them unless the browser wrote something in the last
+# BLOG_REPLICA_PIN_SECONDS (see blog.routers and blog.middleware).
+BLOG_DATABASE_REPLICAS = []
+replica_hosts = [h.strip() for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+replica_conn_max_age = int(os.getenv('DB_REPLICA_CONN_MAX_AGE', os.getenv('DB_CONN_MAX_AGE', '0')))
+for number, address in enumerate(replica_hosts, 1):
+    host, _, port = address.partition(':')
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'CONN_MAX_AGE': replica_conn_max_age,
+        # Tests read the replica through the default connection
+        'TEST': {'MIRROR': 'default'},
+    }
+    BLOG_DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['blog.routers.ReplicaRouter']
+BLOG_REPLICA_PIN_SECONDS = int(os.getenv('BLOG_REPLICA_PIN_SECONDS', '10'))
+
 """DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -111,6 +146,21 @@ DATABASES = {
 }"""
 
 
+# Cache
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache) in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -146,6 +196,21 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # collectstatic fingerprints file names and writes .gz/.br copies, which
+    # blog.middleware.StaticFilesMiddleware serves with immutable caching.
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'blog.staticfiles.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -156,5 +221,28 @@ LOGIN_REDIRECT_URL = 'blog:post_list'
 LOGIN_URL = 'blog:login'
 LOGOUT_URL = 'blog:logout'
 
+# Per-request timings in a Server-Timing header and histograms at /metrics
+BLOG_METRICS = os.getenv('BLOG_METRICS', 'False') == 'True'
+# Bearer token for scraping /metrics; staff users can always read it
+BLOG_METRICS_TOKEN = os.getenv('BLOG_METRICS_TOKEN', '')
+
+# Queue new comments ('spool' or 'database') for the flush_comments worker
+# instead of saving each one in the request; empty saves them directly.
+BLOG_COMMENT_QUEUE = os.getenv('BLOG_COMMENT_QUEUE', '')
+BLOG_COMMENT_SPOOL_DIR = os.getenv('BLOG_COMMENT_SPOOL_DIR', BASE_DIR / 'spool' / 'comments')
+# (comments, seconds) allowed per user
+BLOG_COMMENT_RATE = (5, 60)
+
+# Serve the blog's read paths with the async views (run under ASGI)
+BLOG_ASYNC_VIEWS = os.getenv('BLOG_ASYNC_VIEWS', 'False') == 'True'
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Stream every upload to a temporary file instead of buffering it in memory
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Threads that build resized profile photos after upload
+BLOG_THUMBNAIL_WORKERS = int(os.getenv('BLOG_THUMBNAIL_WORKERS', '2'))